@@ -0,0 +1,423 @@
+import argparse
+import concurrent.futures
+import datetime
+import difflib
+import json
+import os
+import platform
+import random
+import re
+import tempfile
+import time
+import timeit
+
+import journaltools
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows. Peak memory just won't be reported.
+    resource = None
+
+# Benchmarks for the journaltools functions. Run with the name of a benchmark to time it.
+#
+# titles: A micro-benchmark that checks capitalize_title against the code it replaced and times both.
+# pipeline: Generates a synthetic journal volume and times each stage of the processing chain on it. The results are
+#     added to a JSON file so runs can be compared over time.
+# textmodes: Reads PDFs with each of the journaltools.TEXT_MODES and compares the speed and the text, and the metadata
+#     a set of dsplit rules finds in it, with the full layout mode.
+
+# Sample titles in the form capitalize_title gets them from the dsplit files: all caps lines that have been run
+# through str.title().
+SAMPLE_TITLES = [
+    'Constitutional Law--Due Process--Right To Counsel In State Courts',
+    'The Law Of Contracts And The Statute Of Frauds: A Study In Judicial Interpretation',
+    'Torts--Liability Of Landowner For Injuries To Trespassing Children',
+    'Criminal Law: The Right Of The Accused To Be Present At Trial',
+    'Taxation Of Income From Trusts: An Analysis Of Recent Decisions By The Court Of Appeals',
+    'Self- Incrimination And The Fifth Amendment',
+    'The Court\'S Power Over Out Of State Corporations',
+    'Evidence--Admissibility Of Statements Made In The Presence Of The Defendant',
+    'Labor Law: Picketing As Free Speech Under The First And Fourteenth Amendments',
+    'Domestic Relations--Separation Agreements--Effect Of Reconciliation',
+    'Toward\nA Theory Of Contract\tAnd Tort',
+]
+
+
+def capitalize_title_reference(title):
+    # The original capitalize_title, with one re.sub for each word. Kept here to check results against and time.
+    title = re.sub(r'(?<!:.)\sAnd\s', ' and ', title)
+    title = re.sub(r'(?<!:.)\sBut\s', ' but ', title)
+    title = re.sub(r'(?<!:.)\sOf\s', ' of ', title)
+    title = re.sub(r'(?<!:.)\sFor\s', ' for ', title)
+    title = re.sub(r'(?<!:.)\sOr\s', ' or ', title)
+    title = re.sub(r'(?<!:.)\sNor\s', ' nor ', title)
+    title = re.sub(r'(?<!:.)\sA\s', ' A ', title)
+    title = re.sub(r'(?<!:.)\sAn\s', ' an ', title)
+    title = re.sub(r'(?<!:.)\sThe\s', ' the ', title)
+    title = re.sub(r'(?<!:.)\sTo\s', ' to ', title)
+    title = re.sub(r'(?<!:.)\sAs\s', ' as ', title)
+    title = re.sub(r'(?<!:.)\sIn\s', ' in ', title)
+    title = re.sub(r'(?<!:.)\sWith\s', ' with ', title)
+    title = re.sub(r'(?<!:.)\sAt\s', ' at ', title)
+    title = re.sub(r'(?<!:.)\sFrom\s', ' from ', title)
+    title = re.sub(r'(?<!:.)\sInto\s', ' into ', title)
+    title = re.sub(r'(?<!:.)\sOn\s', ' on ', title)
+    title = re.sub(r'(?<!:.)\sIn\s', ' in ', title)
+    title = re.sub(r'(?<!:.)\sBy\s', ' by ', title)
+    title = re.sub(r'(?<!:.)\sUp\s', ' up ', title)
+    title = re.sub(r'(?<!:.)\sOut\s', ' out ', title)
+    # Fix hyphenated words and 'S
+    title = re.sub(r'- ([A-Z])', lambda x: x.group(1).lower(), title)
+    title = re.sub(r'\'S', '\'s', title)
+    return title
+
+
+def timeper(function, items, repeat):
+    # Run function over every item, repeat times, and return the best time per item in microseconds.
+    timer = timeit.Timer(lambda: [function(item) for item in items])
+    loops, total = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=loops))
+    return best / loops / len(items) * 1000000
+
+
+def benchtitles(args):
+    # Compare capitalize_title against the original version on the sample titles.
+    for title in SAMPLE_TITLES:
+        expected = capitalize_title_reference(title)
+        result = journaltools.capitalize_title(title)
+        if args.verbose:
+            print(result)
+        if result != expected:
+            print(f'WARNING! Results differ for {title!r}: {expected!r} != {result!r}')
+
+    reference_time = timeper(capitalize_title_reference, SAMPLE_TITLES, args.repeat)
+    current_time = timeper(journaltools.capitalize_title, SAMPLE_TITLES, args.repeat)
+    print('capitalize_title:')
+    print(f'  original: {reference_time:.2f} us per title')
+    print(f'  current:  {current_time:.2f} us per title')
+    print(f'  speedup:  {reference_time / current_time:.1f}x')
+
+
+# Words for the synthetic journal text. Titles are built from the upper case words, body text from all of them.
+TITLE_WORDS = ['CONSTITUTIONAL', 'LAW', 'DUE', 'PROCESS', 'CONTRACTS', 'TORTS', 'EVIDENCE', 'TAXATION', 'LABOR',
+               'CRIMINAL', 'PROCEDURE', 'RIGHT', 'COUNSEL', 'STATE', 'COURTS', 'LIABILITY', 'LANDOWNER', 'TRUSTS',
+               'OF', 'THE', 'AND', 'IN', 'TO', 'FOR', 'ON']
+BODY_WORDS = ['the', 'court', 'held', 'that', 'plaintiff', 'defendant', 'appeal', 'statute', 'was', 'not', 'in',
+              'of', 'a', 'decision', 'rule', 'which', 'evidence', 'and', 'to', 'by', 'judgment', 'reversed']
+FIRST_NAMES = ['John', 'Mary', 'Robert', 'Ann', 'James', 'Helen', 'William', 'Ruth']
+LAST_NAMES = ['Smith', 'Jones', 'Brown', 'Miller', 'Davis', 'Wilson', 'Moore', 'Taylor']
+
+
+def pdfstring(text):
+    # Escape a string for a PDF text operator.
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def writepdf(filename, pages):
+    # Write a bare-bones PDF file. pages is a list of (width, lines) pairs. Each page is width x 792 points, with the
+    # lines of text set in Helvetica from the top down. There is no compression, so the files are bigger than
+    # real scans, but pdfminer and PyPDF2 have to do the same work to read them.
+    objects = [b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>', None]
+    kids = []
+    for width, lines in pages:
+        stream = 'BT /F1 11 Tf 13 TL 54 740 Td ' + ''.join(pdfstring(line) + ' Tj T* ' for line in lines) + 'ET'
+        stream = stream.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d 792] /Resources << /Font << /F1 1 0 R >> >> '
+                       b'/Contents %d 0 R >>' % (width, len(objects)))
+        kids.append(len(objects))
+    objects[1] = (b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % kid for kid in kids) + b'] /Count %d >>'
+                  % len(kids))
+    objects.append(b'<< /Type /Catalog /Pages 2 0 R >>')
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, pdf_object in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n' % number + pdf_object + b'\nendobj\n'
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, len(objects), xref)
+    with open(filename, 'wb') as pdf_file:
+        pdf_file.write(output)
+
+
+def makevolume(page_count, wide_every=0, first_page=1, seed=1):
+    # Build the pages for a synthetic journal issue, laid out like the recent decisions that dsplit-rd.py reads: each
+    # piece starts with an all caps title and ends with the author's name, and every page has a printed page number.
+    # If wide_every is set, every wide_every-th page is a double-wide magazine spread for croppages. Returns the list
+    # of pages for writepdf and the number of pieces.
+    generator = random.Random(seed)
+    pages = []
+    pieces = 0
+    page_number = 0
+    while page_number < page_count:
+        length = min(generator.randint(2, 8), page_count - page_number)
+        pieces += 1
+        for piece_page in range(0, length):
+            lines = ['Buffalo Law Review', '']
+            if piece_page == 0:
+                title = ' '.join(generator.choice(TITLE_WORDS) for word in range(generator.randint(3, 7)))
+                lines += [title, '']
+            for line in range(0, 40):
+                lines.append(' '.join(generator.choice(BODY_WORDS) for word in range(12)))
+            if piece_page == length - 1:
+                lines += ['', generator.choice(FIRST_NAMES) + ' ' + generator.choice('ABCDEFGH') + '. '
+                          + generator.choice(LAST_NAMES), '']
+            lines += ['', str(first_page + page_number), '']
+            width = 612
+            if wide_every and (page_number + 1) % wide_every == 0:
+                width = 1224
+            pages.append((width, lines))
+            page_number += 1
+    return pages, pieces
+
+
+def makecorpus(directory, page_count, wide_every=0, parts=4, volume=1, year=1951, seed=1):
+    # Write a synthetic volume to directory. The whole volume goes in volume.pdf, and it is also split into parts
+    # with standard Hein file names (01_1BuffLRev1(1951).pdf and so on) for the combine and shift tools. Returns the
+    # volume filename and the list of part filenames.
+    pages, pieces = makevolume(page_count, wide_every, seed=seed)
+    volume_file = os.path.join(directory, 'volume.pdf')
+    writepdf(volume_file, pages)
+
+    part_files = []
+    part_size = max(1, -(-len(pages) // parts))
+    for item, first_page in enumerate(range(0, len(pages), part_size), 1):
+        part_file = os.path.join(directory, f'{item:02d}_{volume}BuffLRev{first_page + 1}({year}).pdf')
+        writepdf(part_file, pages[first_page:first_page + part_size])
+        part_files.append(part_file)
+    return volume_file, part_files
+
+
+def peakrss():
+    # Peak memory use of this process in kilobytes, or None if it can't be measured. Linux reports kilobytes and
+    # macOS reports bytes.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        peak = peak // 1024
+    return peak
+
+
+def runstage(stage, volume_file, part_files, output_dir):
+    # Run one stage of the pipeline and time it. This runs in a fresh process for each stage, so the peak memory
+    # reported belongs to that stage alone. Anything the stage needs from an earlier stage is rebuilt before the
+    # timer starts. Returns the wall time, CPU time, number of pages handled and peak memory.
+    page_text = None
+    ranges = None
+    if stage in ('extract', 'splitpdf'):
+        page_text = journaltools.getpdf(volume_file, 0, False, 0, cache=False)
+    if stage == 'splitpdf':
+        title, start_page, start_pdf_page, end_pdf_page, author = journaltools.extractmetadata(
+            enumerate(page_text), journaltools.PROFILES['rd'], False, 0)
+        ranges = start_pdf_page, end_pdf_page
+
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    if stage == 'getpdf':
+        pages = len(journaltools.getpdf(volume_file, 0, False, 0, cache=False))
+    elif stage == 'extract':
+        journaltools.extractmetadata(enumerate(page_text), journaltools.PROFILES['rd'], False, 0)
+        pages = len(page_text)
+    elif stage == 'splitpdf':
+        journaltools.splitpdf(volume_file, False, 0, ranges[0], ranges[1], os.path.join(output_dir, 'split'))
+        pages = sum(end - start + 1 for start, end in zip(ranges[0], ranges[1]))
+    elif stage == 'croppages':
+        journaltools.croppages(volume_file, os.path.join(output_dir, 'cropped.pdf'), False, False)
+        pages = journaltools.countpages(os.path.join(output_dir, 'cropped.pdf'))
+    elif stage == 'combinepdf':
+        files = journaltools.getfilenames(part_files[0], False)
+        journaltools.combinepdf(files, os.path.join(output_dir, 'combined.pdf'), False)
+        pages = journaltools.countpages(os.path.join(output_dir, 'combined.pdf'))
+    else:
+        raise ValueError(f'Unknown stage {stage}')
+    elapsed = time.perf_counter() - start_time
+    cpu = time.process_time() - start_cpu
+    return elapsed, cpu, pages, peakrss()
+
+
+PIPELINE_STAGES = ['getpdf', 'extract', 'splitpdf', 'croppages', 'combinepdf']
+
+
+def benchpipeline(args):
+    # Generate a synthetic volume and time each pipeline stage on it. Print a table and add the results to the JSON
+    # results file, along with a comparison to the last run with the same settings.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus or temp_dir
+        os.makedirs(corpus_dir, exist_ok=True)
+        output_dir = os.path.join(temp_dir, 'output')
+        os.makedirs(output_dir, exist_ok=True)
+        if args.verbose:
+            print(f'Writing {args.pages} page synthetic volume to {corpus_dir}')
+        volume_file, part_files = makecorpus(corpus_dir, args.pages, args.wide_every)
+
+        stages = {}
+        for stage in args.stages or PIPELINE_STAGES:
+            if args.verbose:
+                print(f'Running {stage}')
+            best = None
+            for run in range(0, args.repeat):
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                    elapsed, cpu, pages, peak = executor.submit(runstage, stage, volume_file, part_files,
+                                                                output_dir).result()
+                if best is None or elapsed < best[0]:
+                    best = elapsed, cpu, pages, peak
+            elapsed, cpu, pages, peak = best
+            stages[stage] = {
+                'seconds': round(elapsed, 4),
+                'cpu_seconds': round(cpu, 4),
+                'pages': pages,
+                'pages_per_second': round(pages / elapsed, 1) if elapsed else None,
+                'peak_rss_kb': peak,
+            }
+
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pages': args.pages,
+        'wide_every': args.wide_every,
+        'stages': stages,
+    }
+
+    # Find the last run with the same settings to compare against.
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as results_file:
+            history = json.load(results_file)
+    previous = None
+    for old_result in reversed(history):
+        if old_result['pages'] == args.pages and old_result['wide_every'] == args.wide_every:
+            previous = old_result
+            break
+
+    print(f'{"stage":<12}{"seconds":>10}{"pages/sec":>12}{"peak RSS MB":>13}{"vs last":>10}')
+    for stage, numbers in stages.items():
+        peak = f'{numbers["peak_rss_kb"] / 1024:.1f}' if numbers['peak_rss_kb'] else '-'
+        change = '-'
+        if previous and stage in previous['stages'] and previous['stages'][stage]['seconds']:
+            change = f'{numbers["seconds"] / previous["stages"][stage]["seconds"]:.2f}x'
+        print(f'{stage:<12}{numbers["seconds"]:>10.3f}{numbers["pages_per_second"] or 0:>12.1f}{peak:>13}{change:>10}')
+
+    history.append(result)
+    with open(args.output, 'w') as results_file:
+        json.dump(history, results_file, indent=2)
+    if args.verbose:
+        print(f'Results added to {args.output}')
+
+
+def benchtextmodes(args):
+    # Read each file with every text mode and compare the results with the layout mode. A mode is safe to use for a
+    # type of file if the metadata matches, even if the page text doesn't match exactly.
+    rules = journaltools.PROFILES[args.rules]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        files = args.files
+        if not files:
+            if args.verbose:
+                print(f'Writing {args.pages} page synthetic volume')
+            volume_file, part_files = makecorpus(temp_dir, args.pages)
+            files = [volume_file]
+
+        for filename in files:
+            results = {}
+            for mode in journaltools.TEXT_MODES:
+                best = None
+                for run in range(0, args.repeat):
+                    start_time = time.perf_counter()
+                    page_text = journaltools.getpdf(filename, 0, False, 0, cache=False, mode=mode)
+                    elapsed = time.perf_counter() - start_time
+                    if best is None or elapsed < best:
+                        best = elapsed
+                metadata = journaltools.extractmetadata(enumerate(page_text), rules, False, 0)
+                results[mode] = best, page_text, metadata
+
+            layout_time, layout_text, layout_metadata = results['layout']
+            print(f'{filename} ({len(layout_text)} pages, {args.rules} rules)')
+            print(f'{"mode":<8}{"seconds":>9}{"speedup":>9}{"same pages":>12}{"line match":>12}{"metadata":>10}')
+            for mode, (elapsed, page_text, metadata) in results.items():
+                same_pages = sum(1 for old, new in zip(layout_text, page_text) if old == new)
+                matcher = difflib.SequenceMatcher(None, '\n'.join(layout_text).splitlines(),
+                                                  '\n'.join(page_text).splitlines(), autojunk=False)
+                same_metadata = 'same' if metadata == layout_metadata else 'DIFFERS'
+                print(f'{mode:<8}{elapsed:>9.3f}{layout_time / elapsed:>8.2f}x{same_pages:>6}/{len(layout_text):<5}'
+                      f'{matcher.ratio():>12.1%}{same_metadata:>10}')
+            print()
+
+
+BENCHMARKS = {
+    'titles': benchtitles,
+    'pipeline': benchpipeline,
+    'textmodes': benchtextmodes,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time journaltools functions and the PDF processing pipeline.'
+    )
+    parser.add_argument('benchmark',
+                        choices=sorted(BENCHMARKS),
+                        help='Benchmark to run.',
+                        )
+    parser.add_argument('-r', '--repeat',
+                        dest='repeat',
+                        type=int,
+                        help='Number of timing runs. The best run is reported. Default is 5 for titles and 1 for the '
+                             'others.',
+                        )
+    parser.add_argument('-f', '--file',
+                        dest='files',
+                        action='append',
+                        help='PDF file to compare the text modes on. Can be given more than once. Default is a '
+                             'synthetic volume.',
+                        )
+    parser.add_argument('--rules',
+                        dest='rules',
+                        choices=sorted(journaltools.PROFILES),
+                        help='dsplit rules to compare the text modes with. Default is rd.',
+                        default='rd',
+                        )
+    parser.add_argument('-p', '--pages',
+                        dest='pages',
+                        type=int,
+                        help='Number of pages in the synthetic volume. Default is 200.',
+                        default=200,
+                        )
+    parser.add_argument('-w', '--wide-every',
+                        dest='wide_every',
+                        type=int,
+                        help='Make every Nth page a double-wide spread, for croppages. 0 for none. Default is 10.',
+                        default=10,
+                        )
+    parser.add_argument('-s', '--stage',
+                        dest='stages',
+                        action='append',
+                        choices=PIPELINE_STAGES,
+                        help='Pipeline stage to run. Can be given more than once. Default is all stages.',
+                        )
+    parser.add_argument('-c', '--corpus',
+                        dest='corpus',
+                        type=str,
+                        help='Directory to write the synthetic PDFs to and keep them. Default is a temporary '
+                             'directory that is deleted afterward.',
+                        )
+    parser.add_argument('-o', '--output-file',
+                        dest='output',
+                        type=str,
+                        help='JSON file to add the pipeline results to. Default is benchmark-results.json.',
+                        default='benchmark-results.json',
+                        )
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        dest='verbose',
+                        help='Print status messages.',
+                        )
+    args = parser.parse_args()
+    if args.repeat is None:
+        args.repeat = 5 if args.benchmark == 'titles' else 1
+
+    BENCHMARKS[args.benchmark](args)
@@ -3,6 +3,8 @@ import os
 
 from journaltools import combinepdf
 from journaltools import getfilenames
+from journaltools import getruns
+from journaltools import Profiler
 
 if __name__ == '__main__':
     # Command-line parser for combinepdf using getfilenames to build the file list.
@@ -12,35 +14,75 @@ if __name__ == '__main__':
     parser.add_argument('filename',
                         type=str,
                         help="File name of the first file in the group that needs to be combined. Files should be "
-                             "standard Hein names",
+                             "standard Hein names. With --all, the directory to search for groups.",
                         )
     parser.add_argument('-v', '--verbose',
                         action='store_true',
                         dest='verbose',
                         help='Print status messages.',
                         )
+    parser.add_argument('-t', '--test',
+                        action='store_true',
+                        help="Test only. Don't output any files. Use with debug options to see test output.",
+                        )
     parser.add_argument('-d', '--debug',
                         action='store_true',
                         help="Show debug output",
                         )
+    parser.add_argument('-a', '--all',
+                        action='store_true',
+                        dest='all',
+                        help="Combine every group of consecutive files in the directory. Each group is written to "
+                             "<first file in group>-NEW.<ext>",
+                        )
     parser.add_argument('-o', '--output-file',
                         dest='destination',
                         type=str,
-                        help='Output file. Default is <input file>-NEW.<ext>',
+                        help='Output file. Default is <input file>-NEW.<ext>. With --all, the directory to write the '
+                             'combined files to.',
+                        )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
                         )
     args = parser.parse_args()
 
-    # If destination file specified, assign it to output_file. If not, then use input filename.
-    if args.destination:
-        output_file = args.destination
+    profiler = Profiler(args.profile)
+
+    if args.all:
+        # Find every run of files in the directory and combine each one into a file named after its first file.
+        with profiler.stage('find runs'):
+            runs = getruns(args.filename, args.debug)
+        for files in runs:
+            output_file, output_extension = os.path.splitext(files[0])
+            output_file = output_file + "-NEW" + output_extension
+            if args.destination:
+                output_file = os.path.join(args.destination, os.path.basename(output_file))
+            if args.verbose or args.test:
+                print(f'{output_file}: {files}')
+            if not args.test:
+                with profiler.stage('combine'):
+                    combinepdf(files, output_file, args.verbose)
     else:
-        output_file, output_extension = os.path.splitext(args.filename)
-        output_file = output_file + "-NEW" + output_extension
+        # If destination file specified, assign it to output_file. If not, then use input filename.
+        if args.destination:
+            output_file = args.destination
+        else:
+            output_file, output_extension = os.path.splitext(args.filename)
+            output_file = output_file + "-NEW" + output_extension
+
+        with profiler.stage('find files'):
+            files = getfilenames(args.filename, args.debug)
 
-    files = getfilenames(args.filename, args.debug)
+        if args.verbose:
+            print(files)
 
-    if args.verbose:
-        print(files)
+        if not args.test:
+            with profiler.stage('combine'):
+                combinepdf(files, output_file, args.verbose)
 
-    if not args.test:
-        combinepdf(files, output_file, args.verbose)
+    profiler.report()
@@ -2,6 +2,13 @@ import os
 import argparse
 
 from journaltools import convertcsv
+from journaltools import filehash
+from journaltools import isfresh
+from journaltools import loadmanifest
+from journaltools import manifeststep
+from journaltools import Profiler
+from journaltools import recordstep
+from journaltools import savemanifest
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -33,6 +40,20 @@ if __name__ == '__main__':
                         help='Show debugging output.',
                         default=0,
                         )
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        dest='incremental',
+                        help='Keep a manifest in the output directory and skip the conversion if the csv file, the '
+                             'template and the Excel file are unchanged since the last run.',
+                        )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
     # Split filename from extension before passing to the various functions. Use input filename for template
@@ -44,4 +65,20 @@ if __name__ == '__main__':
 
     # Read input file, convert to Excel using the columns specified in template_file if  present,
     # then write to output_file.
-    convertcsv(args.input_file, output_file, args.template_file, args.verbose, args.debug)
+    # With --incremental, skip the conversion if the csv file and template haven't changed since the Excel file was
+    # written.
+    manifest = None
+    if args.incremental:
+        manifest = loadmanifest(os.path.dirname(os.path.abspath(output_file)))
+    template_hash = None
+    if args.template_file:
+        template_hash = filehash(args.template_file)
+    convert_step = manifeststep(manifest, 'convertcsv', args.input_file, {'template': template_hash})
+
+    profiler = Profiler(args.profile)
+    if not isfresh(manifest, convert_step):
+        with profiler.stage('convert'):
+            convertcsv(args.input_file, output_file, args.template_file, args.verbose, args.debug)
+        recordstep(manifest, convert_step, [output_file + '.xlsx'])
+        savemanifest(manifest)
+    profiler.report()
@@ -1,6 +1,7 @@
 import argparse
 
 from journaltools import dirshift
+from journaltools import Profiler
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -25,10 +26,27 @@ if __name__ == '__main__':
                         type=str,
                         help='Output file. Default is <input file>.xslx',
                         )
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        help='Number of worker processes to shift files with. Default is 1.',
+                        default=1,
+                        )
     parser.add_argument('path',
                         type=str,
                         help='Import directory containing PDFs that need page shifting.',
                         )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
-    dirshift(args.path, args.verbose, args.debug, args.test)
+    profiler = Profiler(args.profile)
+    with profiler.stage('shift'):
+        dirshift(args.path, args.verbose, args.debug, args.test, args.jobs)
+    profiler.report()
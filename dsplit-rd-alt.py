@@ -1,6 +1,5 @@
 import argparse
 import os
-import re
 
 import journaltools
 
@@ -12,127 +11,11 @@ import journaltools
 # with the code picking up random paragraphs as titles. So, it limits the search to 100 character titles.
 
 
-def processpdfnew(verbose, debug, page_text):
-    # This is the main processing function. It looks through each page of the list passed to it and tries to pull
-    # as much metadata as it can find. This file is designed to be copied and rewritten for each type of source
-    # that needs to be processed. As long as you don't need any more metadata than title, one or two authors, and start
-    # page, only this file needs to be changed.
-
-    # Create lists for all values to be exported to CSV file. Each index value will correspond to the metadata
-    # for one article across all lists. This code assumes that there will be no more than two authors on each article.
-    title = []
-    author = []
-    start_page = []
-    start_pdf_page = []
-    end_pdf_page = []
-
-    # Process each page. Step through pages and attempt to find titles, authors, and page numbers in OCR text.
-    # Store this metadata and the start and end pages of each article into lists.
-    if verbose:
-        print(f'Processing PDF pages')
-
-    for page_number in range(0, len(page_text)):
-
-        if 0 < debug < 6:
-            print('Processing PDF page number %d' % page_number)
-
-        # look for an article title on this page, add lines to title_parts,
-        # then add them together and title capitalize
-        temp_title = ""
-        # Look for all lines that consist only of three or more of the following characters on their own line:
-        # all caps, spaces, hyphens and single quotes.
-        title_parts = re.findall(r'(?<=\n\n)[A-Za-z .:"\'\-\n]{3,100}(?=\n\n)', page_text[page_number])
-        if 1 < debug < 5 and title_parts:
-            print('Title parts: %s' % title_parts)
-
-        # Join all returned lines together in temp_title. Strip extra spaces and use title capitalization.
-        # Any word with an apostrophe comes out with a space before the apostrophe and the next letter
-        # capitalized. Fix in a future version.
-        for t in title_parts:
-            temp_title = temp_title + ' ' + t
-        temp_title = temp_title.strip()
-        temp_title = re.sub(r' {2,}', ' ', temp_title)
-        temp_title = temp_title.title()
-        temp_title = journaltools.capitalize_title(temp_title)
-        # Print processed title at debug levels 1-4.
-        if 0 < debug < 5 and temp_title:
-            print('TITLE: %s' % temp_title)
-
-        # If title is at least four characters long, append to title list. This should be enough to get rid of
-        # garbage lines, but short enough to keep short ones. Look for original page number in OCR text, and
-        # if found append to start_page list. If not, append placeholder string. Append the page number of the
-        # PDF file to start_pdf_page list.
-        if len(temp_title) > 5:
-            title.append(temp_title)
-            original_page_number = re.search(r'^[\d]{1,4}$', page_text[page_number], re.MULTILINE)
-            if original_page_number:
-                start_page.append(original_page_number[0])
-            else:
-                start_page.append(" ")
-            start_pdf_page.append(page_number)
-            if 0 < debug < 5:
-                if original_page_number:
-                    print('Start page in PDF text: %s' % original_page_number[0])
-                else:
-                    print('No start page found in PDF text')
-
-        # Find authors. If one or two lines
-        # are returned, append them to find_author. Append the current PDF file page to end_pdf_page.
-        find_author = re.findall(
-            r'(?<=\n)[A-Z][A-Za-z]*\.? +[A-Z][a-z]*\.? +[A-Za-z]+\.?[,. A-Za-z]{0,6}(?=\n)|'
-            r'(?<=\n)[A-Z][A-Za-z]+ +[A-Z][a-z]+[,. A-Za-z]{0,6}(?=\n)|'
-            r'(?<=\n)[A-Z][A-Za-z]*\.? +[A-Z][a-z]*\.? +[A-Za-z]+\.? +[A-Za-z]+\.?[,. A-Za-z]{0,6}(?=\n)',
-            page_text[page_number])
-        if find_author:
-            author_list = []
-            for count in range(0, 4):
-                try:
-                    f_name, m_name, l_name, suffix = journaltools.splitname(find_author[count])
-                    author_temp = f_name, m_name, l_name, suffix
-                except IndexError:
-                    author_temp = '', '', '', ''
-                author_list.append(author_temp)
-            author.append(author_list)
-            end_pdf_page.append(page_number)
-        if 0 < debug < 5:
-            print('Author: %s' % find_author)
-        if 1 < debug < 5:
-            print(f'PDF start pages: {start_pdf_page}')
-            print(f'PDF end pages: {end_pdf_page}')
-
-    # Compare lists to see if they contain the same number of values. If not, then pad out the short lists with
-    # empty values and throw a warning. Evaluation is in two groups: The values updated when a title is found,
-    # and the values updated when an author is found.
-    if len(title) > len(author):
-        print('WARNING! Missing authors and ending PDF pages')
-        for r in range(len(author), len(title)):
-            author.append([('', '', '', ''), ('', '', '', ''), ('', '', '', ''), ('', '', '', '')])
-            end_pdf_page.append(0)
-    elif len(author) > len(title):
-        print('WARNING! Missing titles, start pages, and starting PDF pages')
-        for r in range(len(title), len(author)):
-            title.append('')
-            start_page.append('')
-            start_pdf_page.append(0)
-
-    # Lots of debugging output
-    # Print all of the lists; debug levels 2 & 4
-    if debug == 2 or debug == 4:
-        print('\n\nAll list values:')
-        print(title)
-        print(author)
-        print(start_page)
-        print(start_pdf_page)
-        print(end_pdf_page)
-    # step through each record and print all contents; debug level 6
-    if debug == 6:
-        print('\n\nAll records:')
-        for r in range(0, len(title)):
-            print(f'Record {r}: {title[r]}; {author[r]}; {start_page[r]}; {start_pdf_page[r]};'
-                  f' {end_pdf_page[r]}')
-
-    # Return all collected metadata lists.
-    return title, start_page, start_pdf_page, end_pdf_page, author
+def processpdfnew(verbose, debug, pages):
+    # This is the main processing function. The rules for finding the titles, authors and page numbers in these
+    # pieces are in the 'rd-alt' profile in journaltools.PROFILES, and journaltools.extractmetadata does the work. To
+    # set this up for another type of source, add a profile there and point a copy of this file at it.
+    return journaltools.extractmetadata(pages, journaltools.PROFILES['rd-alt'], verbose, debug)
 
 
 def main():
@@ -174,7 +57,68 @@ def main():
     parser.add_argument('-i', '--input-file',
                         dest='input_file',
                         type=str,
-                        help="Import CSV file to be used for PDF splitting. Must be in same format as export.")
+                        help="Import CSV file to be used for PDF splitting. Must be in same format as export. A "
+                             ".jsonl file written with --format jsonl also works.")
+    parser.add_argument('-f', '--format',
+                        dest='format',
+                        choices=sorted(journaltools.RECORD_FORMATS),
+                        help='Format of the metadata file. csv is for editing in a spreadsheet. jsonl keeps page '
+                             'numbers as numbers and authors as lists, and can be read back without any loss. '
+                             'Default is csv.',
+                        default='csv',
+                        )
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        help='Number of worker processes to use for reading the PDF text, and number of threads '
+                             'to use for writing the split PDFs. Default is 1.',
+                        default=1,
+                        )
+    parser.add_argument('--no-cache',
+                        action='store_false',
+                        dest='cache',
+                        help="Don't read or write the page text cache.",
+                        )
+    parser.add_argument('--refresh-cache',
+                        action='store_true',
+                        dest='refresh_cache',
+                        help='Re-read the PDF text and replace any cached copy.',
+                        )
+    parser.add_argument('--text-mode',
+                        dest='text_mode',
+                        choices=sorted(journaltools.TEXT_MODES),
+                        help='How much layout analysis to do when reading the PDF text. layout is the slowest and '
+                             'is what the extraction rules were written for. lines and raw are faster. See '
+                             'benchmark.py textmodes. Default is layout.',
+                        default='layout',
+                        )
+    parser.add_argument('--pages',
+                        dest='pages',
+                        type=str,
+                        help='Only read these PDF pages, numbered from 0 like the csv file. For example, '
+                             '"0-4,9,20-99:10" reads pages 0 to 4, page 9 and every tenth page from 20 to 99.',
+                        )
+    parser.add_argument('--pages-from-csv',
+                        dest='pages_from_csv',
+                        type=str,
+                        help='Check the split points in a csv file written by this tool. Only the pages around each '
+                             'start and end page are read, and any split point not found again is listed. No files '
+                             'are written.',
+                        )
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        dest='incremental',
+                        help='Keep a manifest in the output directory and skip any step whose input file, rules and '
+                             'outputs are unchanged since the last run.',
+                        )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
     # Split filename from extension before passing to the various functions. Use input filename for template
@@ -184,23 +128,75 @@ def main():
     else:
         output_file, output_extension = os.path.splitext(args.filename)
 
+    profiler = journaltools.Profiler(args.profile)
+
+    # Pick the pages to read. --pages-from-csv reads only the pages around the split points in a csv file, to check
+    # them without reading the whole PDF again.
+    pagenos = None
+    if args.pages_from_csv:
+        csv_start_pdf_page, csv_end_pdf_page = journaltools.importcsv(args.pages_from_csv, args.debug)
+        pagenos = journaltools.csvpages(csv_start_pdf_page, csv_end_pdf_page)
+    elif args.pages:
+        pagenos = journaltools.parsepages(args.pages)
+
+    # With --incremental, the manifest in the output directory records what each step was last run on. A step is
+    # skipped if its input, rules and outputs haven't changed. Nothing is recorded for test runs or --pages-from-csv.
+    manifest = None
+    if args.incremental and not args.test and not args.pages_from_csv:
+        manifest = journaltools.loadmanifest(os.path.dirname(os.path.abspath(output_file)))
+    metadata_file = output_file + journaltools.RECORD_FORMATS[args.format]
+    extract_step = journaltools.manifeststep(manifest, 'dsplit-rd-alt', args.filename, {
+        'rules': journaltools.ruleshash(journaltools.PROFILES['rd-alt']),
+        'text_mode': args.text_mode,
+        'pages': args.pages,
+        'format': args.format,
+    })
+
     # If importCSV is specified, read that file and get start_pdf_page and end_pdf_page to pass to SplitPDFs
     # If no importCSV is selected, process args.filename
     if args.input_file:
-        start_pdf_page, end_pdf_page = journaltools.importcsv(args.input_file, args.debug)
+        with profiler.stage('import csv'):
+            start_pdf_page, end_pdf_page = journaltools.importcsv(args.input_file, args.debug)
+    elif os.path.exists(metadata_file) and journaltools.isfresh(manifest, extract_step):
+        # The metadata file from the last run is still good (and may have been corrected by hand since), so use it.
+        with profiler.stage('import csv'):
+            start_pdf_page, end_pdf_page = journaltools.importcsv(metadata_file, args.debug)
     else:
         # Fetch OCR page text from PDF file
-        page_text = journaltools.getpdf(args.filename, 0, args.verbose, args.debug)
-        # Process pages
-        title, start_page, start_pdf_page, end_pdf_page, author = processpdfnew(
-            args.verbose, args.debug, page_text)
+        pages = journaltools.iter_pdf_pages(args.filename, 0, args.verbose, args.debug, workers=args.jobs,
+                                            cache=args.cache, refresh_cache=args.refresh_cache,
+                                            mode=args.text_mode, pagenos=pagenos)
+        # Process pages as they are read. The read stage is the pdfminer time for each page, and the rest of the
+        # extract stage is the metadata rules.
+        with profiler.stage('extract'):
+            title, start_page, start_pdf_page, end_pdf_page, author = processpdfnew(
+                args.verbose, args.debug, profiler.pages('read', pages))
+        if args.pages_from_csv:
+            journaltools.checksplits(csv_start_pdf_page, csv_end_pdf_page, start_pdf_page, end_pdf_page, pagenos)
+            profiler.report()
+            return
         # Export CSV file, or show what output would be if test flag is set
-        journaltools.exportcsvnew(output_file, args.verbose, args.debug, args.test, title, start_page, start_pdf_page,
-                                  end_pdf_page, author)
+        with profiler.stage('export csv'):
+            journaltools.exportcsvnew(output_file, args.verbose, args.debug, args.test, title, start_page,
+                                      start_pdf_page, end_pdf_page, author, output_format=args.format)
+        journaltools.recordstep(manifest, extract_step, [metadata_file])
 
     # Split Original PDF into separate documents for each piece, unless test or csvOnly flags are set
     if not args.test and not args.csvOnly:
-        journaltools.splitpdf(args.filename, args.verbose, args.debug, start_pdf_page, end_pdf_page, output_file)
+        split_step = journaltools.manifeststep(manifest, 'splitpdf', args.filename, {
+            'start_pdf_page': start_pdf_page,
+            'end_pdf_page': end_pdf_page,
+            'output_file': os.path.basename(output_file),
+        })
+        if not journaltools.isfresh(manifest, split_step):
+            with profiler.stage('split'):
+                journaltools.splitpdf(args.filename, args.verbose, args.debug, start_pdf_page, end_pdf_page,
+                                      output_file, jobs=args.jobs)
+            journaltools.recordstep(manifest, split_step, [f'{output_file}-{r}.pdf'
+                                                           for r in range(0, len(start_pdf_page))])
+
+    journaltools.savemanifest(manifest)
+    profiler.report()
 
 
 if __name__ == '__main__':
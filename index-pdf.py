@@ -0,0 +1,115 @@
+import argparse
+import concurrent.futures
+import os
+
+import journaltools
+
+# Add the page text of PDF files to the full text index (see journaltools.openindex), so search-pdf.py can find the
+# pages a title or author appears on without running a dsplit job. Only files that are new or have changed since
+# they were last indexed are read, so this can be run over the whole collection again whenever files are added. The
+# page text comes from getpdf, so anything that's already in the page text cache isn't read again either.
+
+
+def findpdfs(paths):
+    # Return a sorted list of the PDF files in paths. Directories are searched all the way down.
+    filenames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, files in os.walk(path):
+                for name in files:
+                    if name.lower().endswith('.pdf'):
+                        filenames.add(os.path.join(directory, name))
+        else:
+            filenames.add(path)
+    return sorted(filenames)
+
+
+def readpdf(filename, mode):
+    # Read the page text of one file in a worker process. Returns the filename and either the text or an error.
+    try:
+        return filename, journaltools.getpdf(filename, 0, False, 0, mode=mode), None
+    except Exception as error:
+        return filename, None, f'{type(error).__name__}: {error}'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Add the page text of PDF files to the full text index searched by search-pdf.py.'
+    )
+    parser.add_argument('paths',
+                        nargs='+',
+                        help='PDF files, or directories to search for PDF files.',
+                        )
+    parser.add_argument('-x', '--index',
+                        dest='index_file',
+                        type=str,
+                        help=f'Index file. Default is {journaltools.INDEX_FILE}, or the JOURNALTOOLS_INDEX environment '
+                             f'variable.',
+                        default=journaltools.INDEX_FILE,
+                        )
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        help='Number of files to read at a time. Default is 1.',
+                        default=1,
+                        )
+    parser.add_argument('--text-mode',
+                        dest='text_mode',
+                        choices=sorted(journaltools.TEXT_MODES),
+                        help='How much layout analysis to do when reading the PDF text. Default is layout.',
+                        default='layout',
+                        )
+    parser.add_argument('--prune',
+                        action='store_true',
+                        dest='prune',
+                        help='Also remove files that no longer exist from the index.',
+                        )
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        dest='verbose',
+                        help='Print status messages.',
+                        )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
+    args = parser.parse_args()
+
+    profiler = journaltools.Profiler(args.profile)
+    connection = journaltools.openindex(args.index_file)
+
+    # Find the files that need to be read. The rest are already up to date in the index.
+    with profiler.stage('check'):
+        filenames = findpdfs(args.paths)
+        stale = [filename for filename in filenames if journaltools.indexstale(connection, filename)]
+    print(f'{len(stale)} of {len(filenames)} files to index ({len(filenames) - len(stale)} unchanged)')
+
+    # Read the files in worker processes and add each one to the index as it comes back. Only this process writes to
+    # the database.
+    with profiler.stage('index'):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(readpdf, filename, args.text_mode) for filename in stale]
+            for future in concurrent.futures.as_completed(futures):
+                filename, page_text, error = future.result()
+                if error:
+                    print(f'WARNING! Could not read {filename}: {error}')
+                    continue
+                journaltools.indexpages(connection, filename, page_text)
+                if args.verbose:
+                    print(f'Indexed {filename}: {len(page_text)} pages')
+
+    if args.prune:
+        with profiler.stage('prune'):
+            removed = journaltools.pruneindex(connection, args.verbose)
+        print(f'{removed} missing files removed from the index')
+
+    connection.close()
+    profiler.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,20 @@
 import fnmatch
 import os
 import re
+import functools
+import time
 import io
 import csv
+import collections
+import itertools
+import concurrent.futures
+import hashlib
+import json
+import sqlite3
+import string
+import sys
+import cProfile
+import contextlib
 
 import PyPDF2
 
@@ -10,8 +22,76 @@ from openpyxl import Workbook
 from openpyxl import load_workbook
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.converter import TextConverter
-from pdfminer.layout import LAParams
+from pdfminer.layout import LAParams, LTChar, LTContainer
 from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+
+try:
+    import numpy
+except ImportError:
+    # The line classifier works without NumPy, just more slowly on big pages.
+    numpy = None
+
+# Page text cache used by getpdf. The directory can be moved with the JOURNALTOOLS_CACHE environment variable. Once the
+# cache is bigger than CACHE_MAX_SIZE bytes, the least recently used entries are deleted.
+CACHE_DIR = os.environ.get('JOURNALTOOLS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'journaltools'))
+CACHE_MAX_SIZE = 500 * 1024 * 1024
+
+# Text extraction modes for getpdf, from slowest to fastest. The value is the layout analysis parameters for pdfminer.
+# layout: Full layout analysis. This is what getpdf has always done, and what all of the dsplit rules were written for.
+# lines: Lines and text boxes are still found, but boxes_flow=None skips working out the reading order of the text
+#     boxes, which is the slowest part of layout analysis. The boxes are just sorted top to bottom.
+# raw: No layout analysis at all. RawTextConverter writes the characters in content stream order, starting a new line
+#     whenever the baseline moves and adding a blank line for bigger gaps.
+# Use benchmark.py textmodes to check whether a cheaper mode gives the same results for a type of file.
+TEXT_MODES = {
+    'layout': LAParams(),
+    'lines': LAParams(boxes_flow=None),
+    'raw': None,
+}
+
+# Full text index of page text made by index-pdf.py and searched by search-pdf.py. The location can be changed with the
+# JOURNALTOOLS_INDEX environment variable.
+INDEX_FILE = os.environ.get('JOURNALTOOLS_INDEX', os.path.join(CACHE_DIR, 'index.sqlite'))
+# Bits of the rowid of each page in the index that hold the page number (see openindex). Up to about a million pages.
+PAGE_ROWID_BITS = 20
+
+# Name of the manifest file that the --incremental option keeps in each output directory.
+MANIFEST_NAME = 'journaltools-manifest.json'
+
+# File extensions for the metadata formats the export functions can write. csv is for editing by hand in a
+# spreadsheet. jsonl has one JSON object per piece, with the page numbers as numbers and the authors as a nested list,
+# so it can be read back exactly as it was written. The import functions go by the extension of the file they're given.
+RECORD_FORMATS = {
+    'csv': '.csv',
+    'jsonl': '.jsonl',
+}
+
+# Most bytes of finished output files that splitpdf will hold in memory while they wait to be written.
+SPLIT_MAX_PENDING = 256 * 1024 * 1024
+
+# Standard Hein file names, in the pattern **_##JournalAbbrev^^^(%%%%-%%%%) * = item number, # = volume number,
+# ^ = start page, % = year(s). The match groups are item number, volume, journal, start page and year(s).
+HEIN_FILENAME = re.compile(r'(\d\d)_(\d{1,2})([A-Za-z]+)([xvi\d\[\]]+)(\(\d{4}-?\d{0,4}\)).pdf')
+
+# Runs of two or more spaces, for cleaning up titles and names.
+MULTIPLE_SPACES = re.compile(r' {2,}')
+
+# Printed page numbers: a line with nothing but one to four digits.
+PAGE_NUMBER = re.compile(r'^[\d]{1,4}$', re.MULTILINE)
+
+# Words that capitalize_title changes to lower case. "A" has never been on the list, so it stays capitalized, but the
+# whitespace around it is still changed to single spaces like the rest (see TITLE_KEEP_WORDS).
+TITLE_STOP_WORDS = ('and', 'but', 'of', 'for', 'or', 'nor', 'an', 'the', 'to', 'as', 'in', 'with', 'at', 'from',
+                    'into', 'on', 'by', 'up', 'out')
+
+# Words that capitalize_title matches along with the stop words, so the whitespace around them is evened out the same
+# way, but leaves capitalized. The original code did this for A with a replacement of ' A '.
+TITLE_KEEP_WORDS = ('A',)
+
+# Hyphenated words that picked up a space and a capital letter after the hyphen, and 'S, for capitalize_title.
+TITLE_FIXES = re.compile(r"- ([A-Z])|'S")
 
 
 def splitname(full_name):
@@ -49,57 +129,136 @@ def splitname(full_name):
     return f_name, m_name, l_name, suffix
 
 
-def splitpdf(filename, verbose, debug, start_pdf_page, end_pdf_page, output_file):
+def writefile(export_file, data):
+    # Write a finished output file to disk. Used by splitpdf to hand off writes to a thread pool.
+    with open(export_file, 'wb') as pdf_output_file:
+        pdf_output_file.write(data)
+
+
+def splitpdf(filename, verbose, debug, start_pdf_page, end_pdf_page, output_file, jobs=1,
+             max_pending=SPLIT_MAX_PENDING):
     # Take input of a source PDF filename, verbose and debug flags, lists of starting and ending pages of individual
     # articles in a single PDF file, and an output file name template. Open the input file, and then create individual
     # files for each page range represented in the two lists.
+    #
+    # The input file is only opened and parsed once. Every output file copies its pages from the same reader, so the
+    # time this takes depends on the number of pages written, not the number of articles times the size of the file.
+    #
+    # If jobs is more than one, each output file is built in memory and then written to disk by a pool of jobs
+    # threads, so the next file can be built while the last ones are still being written. This helps a lot on network
+    # drives. The reader isn't thread-safe, so building the files still happens one at a time, in order. To keep
+    # memory down, no more than max_pending bytes (or two files per thread) are waiting to be written at once.
 
     if verbose:
         print("Exporting split PDFs:")
     # Check to make sure that there are the same number of start and end pages. If not, give the user a warning.
     if len(start_pdf_page) != len(end_pdf_page):
         print('Missing page number. Check input file.')
-    # Loop through a range of numbers between 0 and the number of start pages. For each start page value, open the
-    # input file, pull out the pages between the start page and the matching end page, and write them to a new file
-    # with the output file name, plus the number of the loop counter variable.
-    for r in range(0, len(start_pdf_page)):
-        # This debug output is probably mostly useful if the OCR on your PDF files is good enough to do the metadata
-        # gathering and PDF splitting in one step. None of ours were, so the pages were all checked by hand before
-        # splitting. If yours are better, this could be useful while you're tweaking the regular expressions to extract
-        # your metadata.
-        if 2 < debug < 5:
-            print(f'Record: {r}')
-            print(f'Start page: {start_pdf_page[r]}')
-            print(f'End page: {end_pdf_page[r]}')
-
-        export_file = output_file + '-' + str(r) + '.pdf'
-        if verbose:
-            print(f'Exporting to {export_file}')
-        pdf_output_file = open(export_file, 'wb')
-        pdf_writer = PyPDF2.PdfFileMerger()
-        # Check to make sure that the page ranges make sense. Is the end page after the start page? If so, copy pages
-        # to a new file. If not, give the user an error message.
-        if end_pdf_page > start_pdf_page:
-            pdf_writer.append(filename, pages=(start_pdf_page[r], end_pdf_page[r]+1))
-        else:
-            print(f'End page ({end_pdf_page[r]}) is after start page ({start_pdf_page[r]}) for record {r}')
-        pdf_writer.write(pdf_output_file)
-        pdf_output_file.close()
-
+    input_pdf = open(filename, 'rb')
+    pdf_reader = PyPDF2.PdfFileReader(input_pdf, strict=False)
+    executor = None
+    pending = collections.deque()
+    pending_size = 0
+    if jobs > 1:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    # Loop through a range of numbers between 0 and the number of start pages. For each start page value, pull out
+    # the pages between the start page and the matching end page, and write them to a new file with the output file
+    # name, plus the number of the loop counter variable.
+    try:
+        for r in range(0, len(start_pdf_page)):
+            # This debug output is probably mostly useful if the OCR on your PDF files is good enough to do the
+            # metadata gathering and PDF splitting in one step. None of ours were, so the pages were all checked by
+            # hand before splitting. If yours are better, this could be useful while you're tweaking the regular
+            # expressions to extract your metadata.
+            if 2 < debug < 5:
+                print(f'Record: {r}')
+                print(f'Start page: {start_pdf_page[r]}')
+                print(f'End page: {end_pdf_page[r]}')
+
+            export_file = output_file + '-' + str(r) + '.pdf'
+            if verbose:
+                print(f'Exporting to {export_file}')
+            pdf_writer = PyPDF2.PdfFileWriter()
+            # Check to make sure that the page ranges make sense. Is the end page on or after the start page? If so,
+            # copy pages to a new file. If not, give the user an error message.
+            if end_pdf_page[r] >= start_pdf_page[r]:
+                for page_number in range(start_pdf_page[r], end_pdf_page[r]+1):
+                    pdf_writer.addPage(pdf_reader.getPage(page_number))
+            else:
+                print(f'End page ({end_pdf_page[r]}) is before start page ({start_pdf_page[r]}) for record {r}')
 
-def getpdf(filename, maxpages, verbose, debug):
-    # This code is a little ugly. There is no real documentation for PDFMiner. But I used because its text extraction
-    # is better than PyPDF2. Because of the lack of documentation, I had to work from someone else's demo code to
-    # start. I really should fix the code to allow the user to pass arguments to the converter. It will, for example,
-    # decrypt a password-protected file if the user can send the password.
+            if executor is None:
+                pdf_output_file = open(export_file, 'wb')
+                pdf_writer.write(pdf_output_file)
+                pdf_output_file.close()
+                continue
 
-    # Take in a filename and verbose and debug flags. Open the PDF file filename, then step through each page,
-    # fetch the OCR text, and then add it to a list. When the last page is read, close the file and return the list.
-    # Yes, this probably uses a lot of memory and is inefficient. But given that I needed multiple command-line
-    # front-ends that each looked for slightly different metadata in slightly different places, it ended up being much
-    # easier to separate this code entirely, read the entire file in at once, and pass it all back to the calling
-    # function. Pulling in one page at a time for analysis was messy. Maybe there's a better way to do this, but I
-    # haven't had any issues yet processing PDFs up to about 10MB/150 pages.
+            # Build the file in memory and queue it to be written. Then wait for the oldest writes to finish until
+            # the queue is back under the limits. Calling result() also passes on any error from the write.
+            pdf_buffer = io.BytesIO()
+            pdf_writer.write(pdf_buffer)
+            data = pdf_buffer.getvalue()
+            pending.append((executor.submit(writefile, export_file, data), len(data)))
+            pending_size += len(data)
+            while pending and (pending_size > max_pending or len(pending) > 2 * jobs):
+                future, size = pending.popleft()
+                future.result()
+                pending_size -= size
+        # Wait for any writes that are still queued.
+        while pending:
+            future, size = pending.popleft()
+            future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        input_pdf.close()
+
+
+def countpages(filename, password=''):
+    # Return the number of pages in a PDF file. This only walks the page tree, so it's much faster than running
+    # the pages through the interpreter. Used by getpdf to split the file into page ranges for the worker processes.
+    with open(filename, 'rb') as pdf_file_obj:
+        parser = PDFParser(pdf_file_obj)
+        document = PDFDocument(parser, password)
+        page_count = 0
+        for page in PDFPage.create_pages(document):
+            page_count += 1
+    return page_count
+
+
+class RawTextConverter(TextConverter):
+    # Text converter for the raw text mode. With no layout analysis, pdfminer hands over the characters in the order
+    # they are drawn, with no line breaks and no spaces between words that were positioned separately. This puts in a
+    # line break when the baseline moves, a blank line when it moves by more than one and a half lines (standing in
+    # for the breaks between text boxes), and a space when there is a gap between characters on the same line.
+
+    def receive_layout(self, ltpage):
+        last = None
+        for item in self.iterchars(ltpage):
+            if last is not None:
+                if abs(item.y0 - last.y0) > last.height / 2:
+                    self.write_text('\n')
+                    if last.y0 - item.y0 > last.height * 1.5:
+                        self.write_text('\n')
+                elif item.x0 - last.x1 > TEXT_MODES['layout'].word_margin * max(last.width, last.height):
+                    self.write_text(' ')
+            self.write_text(item.get_text())
+            last = item
+        self.write_text('\n\n\f')
+
+    def iterchars(self, item):
+        # Yield every character on the page, including the ones inside figures.
+        for child in item:
+            if isinstance(child, LTChar):
+                yield child
+            elif isinstance(child, LTContainer):
+                yield from self.iterchars(child)
+
+
+def iterpages(filename, pagenos=None, maxpages=0, mode='layout'):
+    # Open the PDF file filename and yield the OCR text of each page, one page at a time. If pagenos is a set of page
+    # numbers (zero-indexed), only those pages are read. mode is one of the TEXT_MODES. This is the part of getpdf that
+    # does the actual work.
 
     # open file
     pdf_file_obj = open(filename, 'rb')
@@ -110,45 +269,474 @@ def getpdf(filename, maxpages, verbose, debug):
     rsrcmgr = PDFResourceManager()
     retstr = io.StringIO()
     codec = 'utf-8'
-    laparams = LAParams()
-    device = TextConverter(rsrcmgr, retstr, codec=codec, laparams=laparams)
+    laparams = TEXT_MODES[mode]
+    if laparams is None:
+        device = RawTextConverter(rsrcmgr, retstr, codec=codec)
+    else:
+        device = TextConverter(rsrcmgr, retstr, codec=codec, laparams=laparams)
     interpreter = PDFPageInterpreter(rsrcmgr, device)
     password = ""
     caching = True
-    pagenos = set()
+    if pagenos is None:
+        pagenos = set()
+
+    # Step through each page in PDF from first page (page 0) to page maxpages (default=0/all) and yield all text on
+    # the page. Close the file when the last page is read, or when the caller stops asking for pages.
+    try:
+        for page in PDFPage.get_pages(pdf_file_obj, pagenos, maxpages=maxpages, password=password, caching=caching,
+                                      check_extractable=True):
+            # fetch OCR page text
+            interpreter.process_page(page)
+            yield retstr.getvalue()
+
+            # Clear retstr and move current position to start. This clears the last read page from memory before
+            # grabbing the next page.
+            retstr.truncate(0)
+            retstr.seek(0)
+    finally:
+        pdf_file_obj.close()
+        device.close()
+        retstr.close()
+
+
+def getpages(filename, pagenos=None, maxpages=0, mode='layout'):
+    # Return the text from iterpages as a list. It's split out so that each worker process in extractpages can open
+    # the file itself and extract its own range of pages.
+    return list(iterpages(filename, pagenos, maxpages, mode))
+
+
+def extractpages(filename, maxpages, verbose, workers=1, mode='layout', pagenos=None):
+    # Read the text of every page (or every page in pagenos) with getpages. Layout analysis is slow and only uses one
+    # core. If workers is more than one, the pages are split into one contiguous range per worker and each range is
+    # read by getpages in a separate process. The ranges are put back together in order, so the list returned is the
+    # same either way.
+    if workers < 2:
+        return getpages(filename, pagenos, maxpages, mode)
+
+    page_count = countpages(filename)
+    if maxpages:
+        page_count = min(page_count, maxpages)
+    if pagenos:
+        page_list = sorted(page for page in pagenos if page < page_count)
+    else:
+        page_list = list(range(0, page_count))
+    # Nothing to read in an empty file (or an empty selection), so don't start any workers.
+    if not page_list:
+        return []
+    # Build the page ranges. Each worker gets one range, so every process only opens the file once. chunk_size is at
+    # least 1, or range would fail on a step of 0 for files with fewer pages than workers.
+    chunk_size = max(1, -(-len(page_list) // workers))
+    page_ranges = []
+    for first_page in range(0, len(page_list), chunk_size):
+        chunk = page_list[first_page:first_page + chunk_size]
+        page_ranges.append((set(chunk), chunk[-1] + 1))
+    if verbose:
+        print(f'Reading {len(page_list)} pages with {len(page_ranges)} worker processes')
 
-    # Create list  for OCR text from PDF pages
     page_text = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(getpages, filename, pagenos, last_page, mode) for pagenos, last_page in page_ranges]
+        for future in futures:
+            page_text.extend(future.result())
+    return page_text
+
+
+def filehash(filename):
+    # Return the SHA-256 hash of a file's contents. The hash is remembered for as long as the file's size and
+    # modification time stay the same, so checking the same file more than once in a run only reads it once.
+    stat = os.stat(filename)
+    return hashcontents(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=256)
+def hashcontents(filename, size, mtime):
+    # Hash the contents of filename for filehash. size and mtime are only part of the lru_cache key.
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as file_obj:
+        for block in iter(lambda: file_obj.read(1024 * 1024), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def cachekey(filename, maxpages, laparams, pagenos=None):
+    # Build the cache key for a PDF file. The key is a hash of the file contents plus the settings that change what
+    # getpdf returns (the layout analysis parameters, or None for the raw text mode, maxpages and the pages selected,
+    # if any). Renaming or moving the file doesn't matter, but any change to the contents or settings gets a new key.
+    if laparams is not None:
+        laparams = vars(laparams)
+    settings = {'laparams': laparams, 'maxpages': maxpages}
+    if pagenos:
+        settings['pagenos'] = sorted(pagenos)
+    settings = json.dumps(settings, sort_keys=True, default=str)
+    key = hashlib.sha256()
+    key.update(filehash(filename).encode('utf-8'))
+    key.update(settings.encode('utf-8'))
+    return key.hexdigest()
+
+
+def itercache(key, verbose, cache_dir=CACHE_DIR):
+    # Look for page text stored under key. If it's there, return a generator that yields the text of each page from
+    # the cache file. If it isn't, return None. The file's modification time is updated on every hit so that
+    # prunecache knows it was used recently. Cache files have one JSON string per line, so the pages can be read back
+    # one at a time.
+    #
+    # Every line is checked before anything is handed out, so a corrupt or truncated cache file is found before any
+    # pages are used. It is deleted and None is returned, so the PDF is read again. The check only keeps one line in
+    # memory at a time.
+    cache_file = os.path.join(cache_dir, key + '.jsonl')
+    try:
+        with open(cache_file, encoding='utf-8') as cachefile:
+            for line in cachefile:
+                if not isinstance(json.loads(line), str):
+                    raise ValueError('Cache line is not page text')
+        cachefile = open(cache_file, encoding='utf-8')
+    except OSError:
+        return None
+    except ValueError:
+        if verbose:
+            print(f'Cache file is damaged, reading the PDF again: {cache_file}')
+        try:
+            os.remove(cache_file)
+        except OSError:
+            pass
+        return None
+    os.utime(cache_file)
+    if verbose:
+        print(f'Using cached page text: {cache_file}')
+    return readcachefile(cachefile)
+
+
+def readcachefile(cachefile):
+    # Yield each page from an open cache file, then close it.
+    with cachefile:
+        for line in cachefile:
+            yield json.loads(line)
+
+
+def cachepages(key, pages, verbose, cache_dir=CACHE_DIR, max_size=CACHE_MAX_SIZE):
+    # Pass pages through, writing each one to the cache as it goes by. Pages go to a temp file that is only renamed
+    # into place after the last page, so that an interrupted run never leaves a partial cache file behind. Then trim
+    # the cache back down to max_size.
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, key + '.jsonl')
+    temp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+    complete = False
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as cachefile:
+            for text in pages:
+                cachefile.write(json.dumps(text) + '\n')
+                yield text
+        os.replace(temp_file, cache_file)
+        complete = True
+    finally:
+        if not complete and os.path.exists(temp_file):
+            os.remove(temp_file)
+    if verbose:
+        print(f'Page text written to cache: {cache_file}')
+    prunecache(cache_dir, max_size, verbose)
+
+
+def prunecache(cache_dir, max_size, verbose):
+    # Delete the least recently used cache files until the cache is no bigger than max_size bytes.
+    cache_files = []
+    total_size = 0
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.jsonl'):
+            stat = entry.stat()
+            cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+    cache_files.sort()
+    for mtime, size, path in cache_files:
+        if total_size <= max_size:
+            break
+        if verbose:
+            print(f'Removing old cache file: {path}')
+        os.remove(path)
+        total_size -= size
+
+
+def iter_pdf_pages(filename, maxpages, verbose, debug, workers=1, cache=True, refresh_cache=False, mode='layout',
+                   pagenos=None):
+    # Take in a filename and verbose and debug flags. Yield (page_number, text) for each page in the PDF, reading the
+    # pages only as they are asked for. Only the current page is held in memory, so this can be used on volumes that
+    # are too big to read in all at once with getpdf.
+    #
+    # If workers is more than one, the pages are read by extractpages in several processes first and then handed out
+    # one at a time, so that gives up the memory savings for speed. The page text is cached on disk (see CACHE_DIR), so
+    # running the same file again skips the extraction entirely. Set cache to False to bypass the cache, or
+    # refresh_cache to True to re-read the file and replace the cached copy. mode is one of the TEXT_MODES, and each
+    # mode is cached separately.
+    #
+    # pagenos is a set of page numbers (zero-indexed, like start_pdf_page and end_pdf_page in the csv files) to read
+    # instead of the whole file. See parsepages and csvpages. The page numbers yielded are the real page numbers, so
+    # extractmetadata gives the same PDF pages for a piece whether the whole file was read or not.
 
     if verbose:
         print(f'Reading file: {filename}\n')
 
-    # Step through each page in PDF from first page (page 0) to page maxpages (default=0/all), append all text on
-    # page to page_text. Then close file and return page_text.
-    for pageNumber, page in enumerate(PDFPage.get_pages(pdf_file_obj, pagenos, maxpages=maxpages, password=password,
-                                                        caching=caching, check_extractable=True)):
-        # fetch OCR page text; print page text at debug levels 4 & 5
-        interpreter.process_page(page)
-        page_text.append(retstr.getvalue())
+    pages = None
+    if cache:
+        key = cachekey(filename, maxpages, TEXT_MODES[mode], pagenos)
+        if not refresh_cache:
+            pages = itercache(key, verbose)
+
+    if pages is None:
+        if workers > 1:
+            pages = extractpages(filename, maxpages, verbose, workers, mode, pagenos)
+        else:
+            pages = iterpages(filename, pagenos, maxpages, mode)
+        if cache:
+            pages = cachepages(key, pages, verbose)
+
+    if pagenos:
+        page_numbers = iter(sorted(page for page in pagenos if not maxpages or page < maxpages))
+    else:
+        page_numbers = itertools.count()
+    for text in pages:
+        page_number = next(page_numbers)
+        # print page text at debug levels 4 & 5
         if 3 < debug < 6:
-            print(f'Page number {pageNumber}:')
-            print(page_text[pageNumber])
+            print(f'Page number {page_number}:')
+            print(text)
             print('\n')
+        yield page_number, text
 
-        # Clear retstr and move current position to start. This clears the last read page from memory before
-        # grabbing the next page.
-        retstr.truncate(0)
-        retstr.seek(0)
 
-    pdf_file_obj.close()
-    device.close()
-    retstr.close()
+def getpdf(filename, maxpages, verbose, debug, workers=1, cache=True, refresh_cache=False, mode='layout',
+           pagenos=None):
+    # This code is a little ugly. There is no real documentation for PDFMiner. But I used because its text extraction
+    # is better than PyPDF2. Because of the lack of documentation, I had to work from someone else's demo code to
+    # start. I really should fix the code to allow the user to pass arguments to the converter. It will, for example,
+    # decrypt a password-protected file if the user can send the password.
+
+    # Take in a filename and verbose and debug flags. Open the PDF file filename, then step through each page,
+    # fetch the OCR text, and then add it to a list. When the last page is read, close the file and return the list.
+    # Yes, this probably uses a lot of memory and is inefficient. But given that I needed multiple command-line
+    # front-ends that each looked for slightly different metadata in slightly different places, it ended up being much
+    # easier to separate this code entirely, read the entire file in at once, and pass it all back to the calling
+    # function. Pulling in one page at a time for analysis was messy. Maybe there's a better way to do this, but I
+    # haven't had any issues yet processing PDFs up to about 10MB/150 pages. For bigger files, use iter_pdf_pages.
+    #
+    # The pages are read by iter_pdf_pages, so the worker, cache, text mode and page selection options work the same
+    # way here. If pagenos is set, the list only has the pages selected, in order.
+    page_text = []
+    for page_number, text in iter_pdf_pages(filename, maxpages, verbose, debug, workers, cache, refresh_cache, mode,
+                                            pagenos):
+        page_text.append(text)
 
     return page_text
 
 
+def loadmanifest(directory):
+    # Read the manifest in directory, or start a new one if there isn't one. The manifest records each step run by the
+    # command-line tools with --incremental: the hash of the input file, the settings it was run with and the files it
+    # wrote. The steps are keyed by the name of the step and the input file's path relative to the directory.
+    manifest = {'directory': directory, 'steps': {}}
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as manifest_file:
+            manifest['steps'] = json.load(manifest_file)['steps']
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def savemanifest(manifest):
+    # Write the manifest back to its directory. It goes to a temp file first, so an interrupted run can't leave a
+    # broken manifest behind. Does nothing if manifest is None, so callers don't have to check whether --incremental
+    # was used.
+    if manifest is None:
+        return
+    manifest_file = os.path.join(manifest['directory'], MANIFEST_NAME)
+    temp_file = manifest_file + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as manifestfile:
+        json.dump({'steps': manifest['steps']}, manifestfile, indent=2, sort_keys=True)
+    os.replace(temp_file, manifest_file)
+
+
+def manifeststep(manifest, step, input_file, settings):
+    # Describe one step for isfresh and recordstep. settings is anything that changes the output besides the input
+    # file itself, like a hash of the rules used. It has to be something json can store.
+    if manifest is None:
+        return None
+    return {
+        'key': step + ':' + os.path.relpath(os.path.abspath(input_file), os.path.abspath(manifest['directory'])),
+        'step': step,
+        'input_file': input_file,
+        'settings': json.loads(json.dumps(settings)),
+    }
+
+
+def isfresh(manifest, step):
+    # Return True if step was run before on the same input file contents with the same settings, and all of the
+    # files it wrote are still there. Print a message when a step is skipped, so the user knows why nothing happened.
+    if manifest is None:
+        return False
+    entry = manifest['steps'].get(step['key'])
+    if entry is None or entry['settings'] != step['settings'] or entry['hash'] != filehash(step['input_file']):
+        return False
+    for output in entry['outputs']:
+        if not os.path.exists(os.path.join(manifest['directory'], output)):
+            return False
+    print(f'Skipping {step["step"]} for {step["input_file"]}: unchanged since {entry["time"]}')
+    return True
+
+
+def recordstep(manifest, step, outputs):
+    # Record a finished step and the files it wrote in the manifest.
+    if manifest is None:
+        return
+    manifest['steps'][step['key']] = {
+        'hash': filehash(step['input_file']),
+        'settings': step['settings'],
+        'outputs': [os.path.relpath(os.path.abspath(output), os.path.abspath(manifest['directory']))
+                    for output in outputs],
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def openindex(index_file=INDEX_FILE):
+    # Open the page text index, creating it if it isn't there. The index is an SQLite database with a files table
+    # (one row per PDF, with the hash of its contents when it was indexed) and an FTS5 full text table with one row
+    # per page. The page numbers are zero-indexed, like start_pdf_page and end_pdf_page in the csv files.
+    #
+    # The rowid of each page is its file id shifted left by PAGE_ROWID_BITS plus its page number (see pagerowids), so
+    # all of a file's pages can be found by a rowid range. file_id is UNINDEXED in the FTS table, so looking pages up
+    # by it would scan the whole index.
+    directory = os.path.dirname(index_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(index_file)
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            hash TEXT NOT NULL,
+            page_count INTEGER NOT NULL,
+            indexed TEXT NOT NULL
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(text, file_id UNINDEXED, page UNINDEXED);
+    ''')
+    return connection
+
+
+def pagerowids(file_id):
+    # Return the first and last rowid the pages of a file can have in the index.
+    first = file_id << PAGE_ROWID_BITS
+    return first, first + (1 << PAGE_ROWID_BITS) - 1
+
+
+def indexstale(connection, filename):
+    # Return True if filename isn't in the index, or has changed since it was indexed.
+    row = connection.execute('SELECT hash FROM files WHERE path = ?', (os.path.abspath(filename),)).fetchone()
+    return row is None or row[0] != filehash(filename)
+
+
+def indexpages(connection, filename, page_text):
+    # Replace the pages stored for filename in the index with page_text, the list of page text from getpdf. It's all
+    # done in one transaction, so a search never sees a half-indexed file.
+    path = os.path.abspath(filename)
+    if len(page_text) > 1 << PAGE_ROWID_BITS:
+        raise ValueError(f'{filename} has too many pages to index ({len(page_text)})')
+    with connection:
+        row = connection.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row:
+            connection.execute('DELETE FROM pages WHERE rowid BETWEEN ? AND ?', pagerowids(row[0]))
+            connection.execute('DELETE FROM files WHERE id = ?', (row[0],))
+        file_id = connection.execute(
+            'INSERT INTO files (path, hash, page_count, indexed) VALUES (?, ?, ?, ?)',
+            (path, filehash(filename), len(page_text), time.strftime('%Y-%m-%d %H:%M:%S'))).lastrowid
+        first_rowid = pagerowids(file_id)[0]
+        connection.executemany('INSERT INTO pages (rowid, text, file_id, page) VALUES (?, ?, ?, ?)',
+                               ((first_rowid + page_number, text, file_id, page_number)
+                                for page_number, text in enumerate(page_text)))
+
+
+def pruneindex(connection, verbose):
+    # Remove files that no longer exist from the index. Returns the number removed.
+    removed = 0
+    with connection:
+        for file_id, path in connection.execute('SELECT id, path FROM files').fetchall():
+            if not os.path.exists(path):
+                if verbose:
+                    print(f'Removing {path} from the index')
+                connection.execute('DELETE FROM pages WHERE rowid BETWEEN ? AND ?', pagerowids(file_id))
+                connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+                removed += 1
+    return removed
+
+
+def searchindex(connection, query, limit=20, phrase=True):
+    # Search the index for query and return a list of (path, page number, snippet) for the best matching pages,
+    # best first. By default the query is searched for as a phrase, so a title or author name can be pasted in as it
+    # is. Set phrase to False to use the FTS5 query syntax (AND, OR, NOT, "quoted phrases", prefix*, NEAR()).
+    if phrase:
+        query = '"' + query.replace('"', '""') + '"'
+    return connection.execute(
+        '''SELECT files.path, pages.page, snippet(pages, 0, '[', ']', '...', 12)
+           FROM pages JOIN files ON files.id = pages.file_id
+           WHERE pages MATCH ? ORDER BY rank LIMIT ?''',
+        (query, limit)).fetchall()
+
+
+def parsepages(page_spec):
+    # Turn a page selection like "0-4,9,20-99:10" into a set of page numbers for getpdf. Pages are numbered from 0, the
+    # same as the csv files. A range includes both ends, and :N after a range takes every Nth page of it, for sampling
+    # a big file.
+    pagenos = set()
+    for part in page_spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        step = 1
+        if ':' in part:
+            part, step = part.split(':', 1)
+            step = int(step)
+        if '-' in part:
+            first_page, last_page = part.split('-', 1)
+            pagenos.update(range(int(first_page), int(last_page) + 1, step))
+        else:
+            pagenos.add(int(part))
+    return pagenos
+
+
+def csvpages(start_pdf_page, end_pdf_page, radius=1):
+    # Take the start and end pages read from a dsplit csv file by importcsv and return a set of those pages and the
+    # radius pages on either side of each one, for checking the split points without reading the whole file again.
+    pagenos = set()
+    for page in start_pdf_page + end_pdf_page:
+        pagenos.update(range(max(0, page - radius), page + radius + 1))
+    return pagenos
+
+
+def checksplits(start_pdf_page, end_pdf_page, found_start, found_end, pagenos):
+    # Compare the split points in a csv file with the ones found by re-reading only the pages around them. Print any
+    # piece whose start or end page wasn't found again, and any new start or end found in the pages that were read.
+    # Returns the number of problems found.
+    problems = 0
+    found_start = set(found_start)
+    found_end = set(found_end)
+    for r in range(0, len(start_pdf_page)):
+        if start_pdf_page[r] not in found_start:
+            print(f'Record {r}: no title found on start page {start_pdf_page[r]}')
+            problems += 1
+        if end_pdf_page[r] not in found_end:
+            print(f'Record {r}: end page {end_pdf_page[r]} not found')
+            problems += 1
+    for page in sorted(found_start - set(start_pdf_page)):
+        if page in pagenos:
+            print(f'New start page found: {page}')
+            problems += 1
+    for page in sorted(found_end - set(end_pdf_page)):
+        if page in pagenos:
+            print(f'New end page found: {page}')
+            problems += 1
+    if not problems:
+        print(f'All {len(start_pdf_page)} split points found again')
+    return problems
+
+
 def exportcsvnew(output_file, verbose, debug, test, title, start_page, start_pdf_page, end_pdf_page, author,
-                 section=None):
+                 section=None, output_format='csv'):
     # All new export routine that uses tuples for the author names. Most of the metadata scraping routines need to be
     # updated to use this routine instead of the old one. The old code uses two lists for the authors, author 1
     # and author 2. author1 was a list for the first (or sole) author on each piece and author2 was a list for
@@ -159,9 +747,16 @@ def exportcsvnew(output_file, verbose, debug, test, title, start_page, start_pdf
     #
     # This takes a filename, creates that file and then basically just dumps all of the passed lists into the file.
     # It also writes column headers, which are now necessary because the import routines check the headers.
+    #
+    # If output_format is 'jsonl', the lists are written as records instead (see makerecords).
 
     # Export collected metadata to CSV file. If test flag set, display metadata instead.
-    if not test:
+    if not test and output_format == 'jsonl':
+        export_file = output_file + RECORD_FORMATS['jsonl']
+        writerecords(export_file, makerecords(title, start_page, start_pdf_page, end_pdf_page, author, section))
+        if verbose:
+            print("Data written to file: %s" % export_file)
+    elif not test:
         headers = []
         author_count = 0
         # Build the headers.
@@ -243,7 +838,23 @@ def importcsv(filename, debug):
     # input PDF.
 
     # Import a CSV file that has been exported from this code. Read file, import all the values for start_pdf_page and
-    # end_pdf_page as two lists, then return for use by splitpdf.
+    # end_pdf_page as two lists, then return for use by splitpdf. A .jsonl file from exportcsvnew works too.
+    if filename.endswith(RECORD_FORMATS['jsonl']):
+        title, start_page, all_start_pdf_page, all_end_pdf_page, author, section = splitrecords(readrecords(filename))
+        # Leave out pieces with a blank start or end page, the same as for a csv file.
+        start_pdf_page = []
+        end_pdf_page = []
+        for start, end in zip(all_start_pdf_page, all_end_pdf_page):
+            if isinstance(start, int) and isinstance(end, int):
+                start_pdf_page.append(start)
+                end_pdf_page.append(end)
+            else:
+                print('Start or ending PDF pages appear to be missing. Check input file.')
+        if debug:
+            print(start_pdf_page)
+            print(end_pdf_page)
+        return start_pdf_page, end_pdf_page
+
     start_pdf_page = []
     end_pdf_page = []
     start_col = 0
@@ -274,118 +885,464 @@ def importcsv(filename, debug):
     return start_pdf_page, end_pdf_page
 
 
+def fieldvalue(value):
+    # Convert a number field (page, volume, issue or year) from the text form used in the csv files to the form used
+    # in records: an int if it's a number, None if it's blank, or the text as is for anything else, like a page number
+    # in roman numerals.
+    if isinstance(value, str):
+        if value.strip().isdigit():
+            return int(value)
+        if not value.strip():
+            return None
+    return value
+
+
+def csvvalue(value):
+    # Convert a record field back to text for a csv file.
+    if value is None:
+        return ''
+    return str(value)
+
+
+def authorrecords(authors):
+    # Convert a list of (first, middle, last, suffix) name tuples to the list of dicts used in records, leaving out
+    # the blank ones that the csv files use as padding.
+    return [{'first': first, 'middle': middle, 'last': last, 'suffix': suffix}
+            for first, middle, last, suffix in authors if first or middle or last or suffix]
+
+
+def authortuples(authors):
+    # Convert the author dicts in a record back to name tuples.
+    return [(name['first'], name['middle'], name['last'], name['suffix']) for name in authors]
+
+
+def makerecords(title, start_page, start_pdf_page, end_pdf_page, author, section=None):
+    # Turn the lists from extractmetadata (or importxl) into one record per piece. start_pdf_page and end_pdf_page are
+    # ints, or None if they are blank (see fieldvalue), like the other number fields. The section is only included if
+    # there is one.
+    records = []
+    for r in range(0, len(title)):
+        record = {'title': title[r]}
+        if section:
+            record['section'] = section[r]
+        record['start_page'] = fieldvalue(start_page[r])
+        record['start_pdf_page'] = fieldvalue(start_pdf_page[r])
+        record['end_pdf_page'] = fieldvalue(end_pdf_page[r])
+        record['authors'] = authorrecords(author[r])
+        records.append(record)
+    return records
+
+
+def splitrecords(records):
+    # Turn records back into the lists that exportcsvnew and splitpdf take. section is None if no record has one.
+    title = [record['title'] for record in records]
+    start_page = [record['start_page'] for record in records]
+    start_pdf_page = [record['start_pdf_page'] for record in records]
+    end_pdf_page = [record['end_pdf_page'] for record in records]
+    author = [authortuples(record['authors']) for record in records]
+    section = None
+    if any('section' in record for record in records):
+        section = [record.get('section', '') for record in records]
+    return title, start_page, start_pdf_page, end_pdf_page, author, section
+
+
+def writerecords(export_file, records, append=False):
+    # Write records to a JSON Lines file, one record per line. Set append to add them to the end of an existing file.
+    with open(export_file, 'a' if append else 'w', encoding='utf-8') as recordfile:
+        for record in records:
+            recordfile.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def readrecords(filename):
+    # Read all of the records from a JSON Lines file written by writerecords.
+    with open(filename, encoding='utf-8') as recordfile:
+        return [json.loads(line) for line in recordfile if line.strip()]
+
+
+def recordrows(records):
+    # Yield the records as rows of text, with a header row first, laid out the same way as a csv file from
+    # exportcsvnew or mdgen-blr.py. This lets code written for the csv files read records too. The authors are
+    # flattened into f_name1, m_name1, l_name1, suffix1 and so on, for at least four authors.
+    fields = []
+    author_count = 4
+    for record in records:
+        for field in record:
+            if field != 'authors' and field not in fields:
+                fields.append(field)
+        author_count = max(author_count, len(record.get('authors', [])))
+    headers = list(fields)
+    for c in range(0, author_count):
+        headers.extend(['f_name' + str(c+1), 'm_name' + str(c+1), 'l_name' + str(c+1), 'suffix' + str(c+1)])
+    yield headers
+    for record in records:
+        row = [csvvalue(record.get(field)) for field in fields]
+        authors = authortuples(record.get('authors', []))
+        for c in range(0, author_count):
+            if c < len(authors):
+                row.extend(authors[c])
+            else:
+                row.extend(['', '', '', ''])
+        yield row
+
+
+def readrows(input_file, quotechar='"'):
+    # Yield the rows of a csv file, or of a records file (see recordrows), starting with the header row. Used by
+    # the convertcsv functions so they can take either kind of file.
+    if input_file.endswith(RECORD_FORMATS['jsonl']):
+        yield from recordrows(readrecords(input_file))
+        return
+    with open(input_file, newline='') as csvfile:
+        yield from csv.reader(csvfile, delimiter=",", quotechar=quotechar, quoting=csv.QUOTE_MINIMAL)
+
+
+class PageView:
+    # One page in a PagePipeline. A view only records which page of the source file it shows and its media box, so
+    # cropping or duplicating a page doesn't copy anything. The page object for the output file is built from the
+    # source page by materialize when the pipeline is written.
+
+    def __init__(self, page_number, media_box):
+        self.page_number = page_number
+        self.media_box = media_box
+
+    def crop(self, lower_left, upper_right):
+        # Set the media box to the (x, y) corners given. Returns the view, so it can be passed straight to append.
+        self.media_box = (tuple(lower_left), tuple(upper_right))
+        return self
+
+    def duplicate(self):
+        # Return a new view of the same page, with the same crop, that can be changed separately.
+        return PageView(self.page_number, self.media_box)
+
+    def materialize(self, source_page):
+        # Build the output page from the source page object. This is a copy of the page dictionary only (see
+        # copypage), so every view of a page shares the one content stream.
+        page = copypage(source_page)
+        page.mediaBox.lowerLeft, page.mediaBox.upperRight = self.media_box
+        return page
+
+
+class PagePipeline:
+    # Build a new PDF out of views of the pages of input_file. Get a view of a page with page, crop or duplicate
+    # it, and append it to the output. Nothing is added to a PyPDF2 writer until write, which makes each page
+    # object once from its view. A page used more than once, like a double page split into left and right halves, has
+    # its contents read and written only once. Use it in a with block, or call close, to close input_file.
+
+    def __init__(self, input_file):
+        self.input_pdf = open(input_file, 'rb')
+        self.reader = PyPDF2.PdfFileReader(self.input_pdf, strict=False)
+        self.page_count = self.reader.getNumPages()
+        self.views = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.input_pdf.close()
+
+    def page(self, page_number):
+        # Return a view of a page of the source file, with its own media box.
+        media_box = self.reader.getPage(page_number).mediaBox
+        return PageView(page_number, (tuple(media_box.lowerLeft), tuple(media_box.upperRight)))
+
+    def append(self, view):
+        # Add a view to the end of the output.
+        self.views.append(view)
+
+    def write(self, output_file):
+        # Make the page objects and write the output file.
+        pdf_writer = PyPDF2.PdfFileWriter()
+        for view in self.views:
+            pdf_writer.addPage(view.materialize(self.reader.getPage(view.page_number)))
+        with open(output_file, 'wb') as pdf_output_file:
+            pdf_writer.write(pdf_output_file)
+
+
 def doublepages(input_file, output_file, verbose):
     # This will double any page wider than 700 points in a PDF. It is the first part of a workflow designed to
     # crop files that were scanned from stapled magazine pages, with only the cover cropped. The routine checks
     # the page width. If narrowed than 700 points, it assigns a value of "S" to the page_type list. If it's wider,
     # it copies the page and assigns "L" as the page type to one and "R" to the other copy. This tells croppages
     # which side of the full page to keep, left or right. "S" pages are cropped to 8.5 x 11.
+    # croppages now does the doubling itself in the same pass as the crop, so this is only needed if you want the
+    # doubled file on its own. The copy is a PageView, so the two pages share one content stream in the output.
 
     page_type = []
     if verbose:
         print(f'Processing {input_file}')
-    pdf_output_file = open(output_file, 'wb')
-    pdf_writer = PyPDF2.PdfFileWriter()
-    input_pdf = open(input_file, 'rb')
-    pdf_reader = PyPDF2.PdfFileReader(input_pdf, strict=False)
-
-    # Step through file and double all but the first and last pages
-    max_pages = pdf_reader.getNumPages()
-    for page_number in range(0, max_pages):
-        page_obj = pdf_reader.getPage(page_number)
-        # Check page size
-        if page_obj.mediaBox.upperRight[0] < 700:
-            # single page
-            pdf_writer.addPage(page_obj)
-            page_type.append('S')
-        else:
-            # double page
-            pdf_writer.addPage(page_obj)
-            page_type.append('L')
-            pdf_writer.addPage(page_obj)
-            page_type.append('R')
+    with PagePipeline(input_file) as pipeline:
+
+        # Step through file and double all but the first and last pages
+        for page_number in range(0, pipeline.page_count):
+            view = pipeline.page(page_number)
+            # Check page size
+            if view.media_box[1][0] < 700:
+                # single page
+                pipeline.append(view)
+                page_type.append('S')
+            else:
+                # double page
+                pipeline.append(view)
+                page_type.append('L')
+                pipeline.append(view.duplicate())
+                page_type.append('R')
 
-    if verbose:
-        print('Writing temp file')
-    pdf_writer.write(pdf_output_file)
-    input_pdf.close()
-    pdf_output_file.close()
+        if verbose:
+            print(f'Writing {output_file}')
+        pipeline.write(output_file)
 
     return page_type
 
 
+def copypage(page_obj):
+    # Make a second page object for a page. The copy shares the contents and resources of the original, so they are
+    # only stored once in the output file, but it gets its own media box so the two can be cropped differently.
+    new_page = PyPDF2.pdf.PageObject(page_obj.pdf)
+    new_page.update(page_obj)
+    new_page[PyPDF2.generic.NameObject('/MediaBox')] = PyPDF2.generic.RectangleObject(page_obj.mediaBox)
+    return new_page
+
+
 def croppages(input_file, output_file, verbose, debug):
-    # Set temporary filename and call doublepages. This will make a copy of all large pages that need to be split, and
-    # assign a type (S=Single page, regular crop; L=Large page, left side crop; R=Large page, right side crop).
-    temp_filename, temp_extension = os.path.splitext(input_file)
-    temp_filename = temp_filename + '-temp' + temp_extension
-    page_type = doublepages(input_file, temp_filename, verbose)
-    # TODO: Integrate doublepages into this code?
+    # Crop every page in a PDF to 8.5 x 11. This is done in one pass. Each page is checked as it is read. Any page
+    # narrower than 700 points is a single page (S) and is cropped to 8.5 x 11 from the upper right. Any wider page
+    # is a double page. It gets a copy of itself, and the copy is cropped to the left side (L) and the original to the
+    # right side (R). This used to be done with doublepages writing a temp file that was then read back in to crop,
+    # which doubled the disk I/O and parsing time. The crops are PageViews in a PagePipeline, so the source pages are
+    # left alone and each page's contents are only copied once, when the file is written.
 
     if verbose:
-        print(f'Processing {temp_filename}')
-    pdf_output_file = open(output_file, 'wb')
-    pdf_writer = PyPDF2.PdfFileWriter()
-    input_pdf = open(temp_filename, 'rb')
-    pdf_reader = PyPDF2.PdfFileReader(input_pdf, strict=False)
+        print(f'Processing {input_file}')
+    with PagePipeline(input_file) as pipeline:
+
+        # Step through file and crop pages. output_page keeps count of the page numbers in the output file for the
+        # debug output, since double pages add an extra page.
+        output_page = 0
+        for page_number in range(0, pipeline.page_count):
+            view = pipeline.page(page_number)
+            (lower_left_x, lower_left_y), (upper_right_x, upper_right_y) = view.media_box
+
+            # Check page size and assign the page type(s)
+            if upper_right_x < 700:
+                page_types = ['S']
+            else:
+                page_types = ['L', 'R']
 
-    # Step through file and crop pages
-    max_pages = pdf_reader.getNumPages()
-    for page_number in range(0, max_pages):
-        page_obj = pdf_reader.getPage(page_number)
-        lower_left_x, lower_left_y = page_obj.mediaBox.lowerLeft
-        upper_right_x, upper_right_y = page_obj.mediaBox.upperRight
+            for page_type in page_types:
+                # Debugging statements
+                if debug:
+                    print(output_page)
+                    print(lower_left_x, lower_left_y, upper_right_x, upper_right_y)
+                    print(view.media_box)
+
+                # Crop the page
+                if page_type == 'L':
+                    # double page; left crop. Crop a duplicate, so the view is still whole for the right crop.
+                    pipeline.append(view.duplicate().crop((0, upper_right_y - 792), (612, upper_right_y)))
+                else:
+                    # single page, or double page; right crop
+                    pipeline.append(view.crop((upper_right_x - 612, upper_right_y - 792),
+                                              (upper_right_x, upper_right_y)))
+                output_page += 1
 
-        # Debugging statements
-        if debug:
-            print(page_number)
-            print(lower_left_x, lower_left_y, upper_right_x, upper_right_y)
-            print(page_obj.mediaBox.lowerLeft)
-            print(page_obj.mediaBox.lowerRight)
-            print(page_obj.mediaBox.upperLeft)
-            print(page_obj.mediaBox.upperRight)
-
-        # Check page size and crop
-        if page_type[page_number] == 'S':
-            # single page
-            page_obj.mediaBox.lowerLeft = (upper_right_x - 612, upper_right_y - 792)
-            pdf_writer.addPage(page_obj)
-        elif page_type[page_number] == 'L':
-            # double page; left crop
-            page_obj.mediaBox.lowerLeft = (0, upper_right_y - 792)
-            page_obj.mediaBox.upperRight = (612, upper_right_y)
-            pdf_writer.addPage(page_obj)
-        elif page_type[page_number] == 'R':
-            # double page; right crop
-            page_obj.mediaBox.lowerLeft = (upper_right_x - 612, upper_right_y - 792)
-            page_obj.mediaBox.upperRight = (upper_right_x, upper_right_y)
-            pdf_writer.addPage(page_obj)
-
-    pdf_writer.write(pdf_output_file)
-    input_pdf.close()
-    pdf_output_file.close()
-    if verbose:
-        print('Deleting temp file')
-    if os.path.exists(temp_filename):
-        os.remove(temp_filename)
+        if verbose:
+            print(f'Writing {output_file}')
+        pipeline.write(output_file)
+
+
+class MergeWriter:
+    # Combine PDF files into one, writing as it goes. Each input is opened, its pages and everything they use are
+    # written to the output, and it is closed before the next one is opened, so only one input is in memory at a time.
+    # PdfFileMerger holds every input until the end.
+    #
+    # Objects are copied depth first, so an object's references have already been renumbered by the time it is
+    # written. Each object is hashed as it would be written (sha256). If the same bytes have already been written, the
+    # earlier object is used instead. Fonts and images that are the same in several inputs, like the parts of a Hein
+    # volume, are only stored once, and so are the font descriptors and resource dictionaries that point to them.
+    # bytes_saved is the total size of the objects left out. Only the hashes of what has been written are kept, not
+    # the objects.
+    #
+    # Only the pages are copied. Bookmarks, named destinations and document info from the inputs are left out.
+
+    def __init__(self, output_file, version=b'%PDF-1.4'):
+        self.output = open(output_file, 'wb')
+        self.output.write(version + b'\n%\xe2\xe3\xcf\xd3\n')
+        # Object 1 is the page tree and 2 the catalog. They are written last, once all of the pages are known.
+        self.offsets = [None, None]
+        self.pages = []
+        self.hashes = {}
+        self.bytes_written = 0
+        self.bytes_saved = 0
+        self.objects_saved = 0
+        # Reference map for the input being copied: (object number, generation) in the input to object number in the
+        # output. in_progress holds the objects being copied further up the stack, for references that loop back.
+        # dropped holds the pages of the input that aren't being copied.
+        self.copied = {}
+        self.in_progress = {}
+        self.dropped = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't finish a file that failed part way through.
+        if exc_type is None:
+            self.close()
+        else:
+            self.output.close()
+
+    def allocate(self):
+        # Reserve the next object number.
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def writeobject(self, number, data):
+        # Write one object to the output.
+        self.offsets[number - 1] = self.output.tell()
+        self.output.write(b'%d 0 obj\n' % number + data + b'\nendobj\n')
+        self.bytes_written += len(data)
+
+    def serialize(self, obj):
+        # Return the bytes for a direct object from renumber.
+        stream = io.BytesIO()
+        obj.writeToStream(stream, None)
+        return stream.getvalue()
+
+    def renumber(self, obj):
+        # Return a copy of a direct object with every reference in it changed to the output object number, copying the
+        # referenced objects first if they haven't been copied yet. Stream data is shared with the original.
+        if isinstance(obj, PyPDF2.generic.IndirectObject):
+            if (obj.idnum, obj.generation) in self.dropped:
+                return PyPDF2.generic.NullObject()
+            return PyPDF2.generic.IndirectObject(self.copyobject(obj), 0, None)
+        if isinstance(obj, PyPDF2.generic.DictionaryObject):
+            new_obj = obj.__class__.__new__(obj.__class__)
+            PyPDF2.generic.DictionaryObject.__init__(new_obj)
+            if isinstance(obj, PyPDF2.generic.StreamObject):
+                new_obj._data = obj._data
+                new_obj.decodedSelf = None
+            for key, value in obj.items():
+                # A stream's /Length is written from its data, so don't copy a separate length object.
+                if not (key == '/Length' and isinstance(obj, PyPDF2.generic.StreamObject)):
+                    new_obj[key] = self.renumber(value)
+            return new_obj
+        if isinstance(obj, PyPDF2.generic.ArrayObject):
+            return PyPDF2.generic.ArrayObject(self.renumber(value) for value in obj)
+        return obj
+
+    def copyobject(self, reference):
+        # Copy an indirect object from the input and return its number in the output. An object that is part of a loop
+        # of references gets its number before its contents are known, so it is always written, never swapped for an
+        # earlier copy.
+        key = reference.idnum, reference.generation
+        if key in self.copied:
+            return self.copied[key]
+        if key in self.in_progress:
+            if self.in_progress[key] is None:
+                self.in_progress[key] = self.allocate()
+            return self.in_progress[key]
+
+        self.in_progress[key] = None
+        data = self.serialize(self.renumber(reference.getObject()))
+        number = self.in_progress.pop(key)
+        digest = hashlib.sha256(data).digest()
+        if number is None and digest in self.hashes:
+            number = self.hashes[digest]
+            self.bytes_saved += len(data)
+            self.objects_saved += 1
+        else:
+            if number is None:
+                number = self.allocate()
+            self.writeobject(number, data)
+            self.hashes.setdefault(digest, number)
+        self.copied[key] = number
+        return number
+
+    def append(self, input_file, pages=None):
+        # Copy pages from input_file to the end of the output. pages is a list of page indexes, starting from 0, or
+        # None for all of them.
+        with open(input_file, 'rb') as input_pdf:
+            self.appendreader(PyPDF2.PdfFileReader(input_pdf, strict=False), pages)
+
+    def appendreader(self, pdf_reader, pages=None):
+        # Copy pages from a PdfFileReader that is already open, like append. The same reader can be appended to more
+        # than one MergeWriter without parsing the file again. Every page in the list gets its output number up front,
+        # so annotations and links that point to a page point to the copy. References to pages that aren't copied
+        # become null, so they don't pull in the rest of the input.
+        page_objects = [pdf_reader.getPage(page_number) for page_number in range(pdf_reader.getNumPages())]
+        if pages is None:
+            pages = range(len(page_objects))
+        numbers = {page_number: self.allocate() for page_number in pages}
+        self.copied = {}
+        self.in_progress = {}
+        self.dropped = set()
+        for page_number, page_obj in enumerate(page_objects):
+            page_ref = page_obj.indirectRef
+            if page_number in numbers:
+                self.copied[page_ref.idnum, page_ref.generation] = numbers[page_number]
+            else:
+                self.dropped.add((page_ref.idnum, page_ref.generation))
+        for page_number, number in numbers.items():
+            # The page object from getPage already has any attributes it inherits from the input's page tree, so its
+            # parent can be swapped for the output's.
+            page = PyPDF2.generic.DictionaryObject(page_objects[page_number])
+            page.pop('/Parent', None)
+            page = self.renumber(page)
+            page[PyPDF2.generic.NameObject('/Parent')] = PyPDF2.generic.IndirectObject(1, 0, None)
+            self.writeobject(number, self.serialize(page))
+            self.pages.append(number)
+        self.copied = {}
+        self.dropped = set()
+
+    def close(self):
+        # Write the page tree, the catalog, the cross-reference table and the trailer, and close the file. Returns
+        # (bytes written, bytes saved) for the object data.
+        if self.output.closed:
+            return self.bytes_written, self.bytes_saved
+        kids = b' '.join(b'%d 0 R' % number for number in self.pages)
+        self.writeobject(1, b'<< /Type /Pages /Kids [ %s ] /Count %d >>' % (kids, len(self.pages)))
+        self.writeobject(2, b'<< /Type /Catalog /Pages 1 0 R >>')
+        xref = self.output.tell()
+        self.output.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.offsets) + 1))
+        for offset in self.offsets:
+            self.output.write(b'%010d 00000 n \n' % offset)
+        self.output.write(b'trailer\n<< /Size %d /Root 2 0 R >>\nstartxref\n%d\n%%%%EOF\n' %
+                          (len(self.offsets) + 1, xref))
+        self.output.close()
+        return self.bytes_written, self.bytes_saved
+
+
+def pdfversion(input_files):
+    # Return the highest PDF version header of input_files, like b'%PDF-1.4', for a file combining them.
+    versions = [b'%PDF-1.4']
+    for input_file in input_files:
+        with open(input_file, 'rb') as input_pdf:
+            header = input_pdf.read(8)
+        if re.fullmatch(rb'%PDF-\d\.\d', header):
+            versions.append(header)
+    return max(versions)
 
 
 def combinepdf(input_files, output_file, verbose):
     # This will quickly combine several PDFs into one file. It can be used with bash scripts to combine things that
     # are regularly split up in a file set. I used this to recombine parts of indexes for a law journal into
-    # one file for each volume.
+    # one file for each volume. The files are streamed into the output one at a time with MergeWriter, and fonts and
+    # images they share are only stored once. Returns the number of bytes saved by that.
 
     # Set and open output file.
     if verbose:
         print(f'Combining {input_files}')
-    pdf_output_file = open(output_file, 'wb')
-    pdf_writer = PyPDF2.PdfFileMerger()
 
     # Step through files in input_files list and combine them into output_file
-    for r in range(0, len(input_files)):
-        pdf_writer.append(input_files[r])
-    pdf_writer.write(pdf_output_file)
-    pdf_output_file.close()
+    with MergeWriter(output_file, pdfversion(input_files)) as pdf_writer:
+        for r in range(0, len(input_files)):
+            pdf_writer.append(input_files[r])
+    if verbose:
+        print(f'Wrote {output_file}. {pdf_writer.objects_saved} duplicate objects left out, saving '
+              f'{pdf_writer.bytes_saved} bytes')
+    return pdf_writer.bytes_saved
 
 
 def shiftpage(input_file1, input_file2, output_file, verbose):
@@ -396,18 +1353,14 @@ def shiftpage(input_file1, input_file2, output_file, verbose):
 
     if verbose:
         print(f'Opening {input_file1}')
-    pdf_output_file = open(output_file, 'wb')
-    pdf_writer = PyPDF2.PdfFileMerger()
 
-    # Use PdfFileMerger to append the first page of input_file2 to the end of input_file1. Append takes a start and
-    # a stop page argument. The stop page is not included in the output. The default is the entire file.
-    pdf_writer.append(input_file1)
-    pdf_writer.append(input_file2, pages=(0, 1))
-
-    if verbose:
-        print(f'Writing {pdf_output_file}')
-    pdf_writer.write(pdf_output_file)
-    pdf_output_file.close()
+    # Use MergeWriter to append the first page of input_file2 to the end of input_file1. Append takes a list of the
+    # pages to copy. The default is the entire file.
+    with MergeWriter(output_file, pdfversion([input_file1, input_file2])) as pdf_writer:
+        pdf_writer.append(input_file1)
+        pdf_writer.append(input_file2, pages=[0])
+        if verbose:
+            print(f'Writing {output_file}')
 
 
 def convertcsv(input_file, output_file, template_file, verbose, debug):
@@ -445,6 +1398,10 @@ def convertcsv(input_file, output_file, template_file, verbose, debug):
                     author_col.append(c + 1)
         if debug:
             print(author_col)
+        # A column the template doesn't have is left out of the output, the same as section.
+        for heading, col in (('title', title_col), ('fpage', page_col)):
+            if not col:
+                print(f'WARNING! Template {template_file} has no {heading} column. It will be left out.')
     else:
         title_col = 1
         page_col = 37
@@ -453,10 +1410,12 @@ def convertcsv(input_file, output_file, template_file, verbose, debug):
     if debug:
         print(f'{title_col}, {page_col}, {author_col}')
 
-    wb = Workbook()
-    ws = wb.active
-    wbrow = 1
+    # The workbook is opened in write-only mode, so rows are streamed out to the file as they are appended instead of
+    # being held in memory. Each row is built as a list first, with a slot for every column up to the last one used.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
     dest_filename = output_file + '.xlsx'
+    last_col = max([c for c in (title_col, page_col, section_col) if c] + [c + 6 for c in author_col])
 
     if verbose:
         print(f'Reading {input_file}')
@@ -464,9 +1423,8 @@ def convertcsv(input_file, output_file, template_file, verbose, debug):
     # Step through each row of input CSV file. Read in each row and assign to variables. Write to Excel file.
     # The columns are hard-coded to correspond to the Digital Commons import columns for Buffalo Law Review.
     # To be more useful, this could write to an output and write the values in the columns based on the
-    # headers.
-    with open(input_file, newline='') as csvfile:
-        data_reader = csv.reader(csvfile, delimiter=",", quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    # headers. The input can also be a .jsonl records file; readrows lays it out the same way.
+    with contextlib.closing(readrows(input_file)) as data_reader:
 
         # Check headers to get column numbers; Write headers in destination file
         headers = next(data_reader)
@@ -474,101 +1432,198 @@ def convertcsv(input_file, output_file, template_file, verbose, debug):
         page_in_col = ''
         section_in_col = ''
         author_in_col = []
+        title_flag = 0
+        wb_row = [None] * last_col
 
         for c in range(0, len(headers)):
-            if headers[c] == 'title':
+            # Only copy columns the output has. A column number of 0 would write to the last column instead.
+            if headers[c] == 'title' and title_col:
                 title_in_col = c
-                ws.cell(row=wbrow, column=title_col, value='title')
+                wb_row[title_col - 1] = 'title'
                 title_flag = 1
-            if headers[c] == 'start_page':
+            if headers[c] == 'start_page' and page_col:
                 page_in_col = c
-                ws.cell(row=wbrow, column=page_col, value='fpage')
-            if headers[c] == 'section':
+                wb_row[page_col - 1] = 'fpage'
+            if headers[c] == 'section' and section_col:
                 section_in_col = c
-                ws.cell(row=wbrow, column=section_col, value='section')
+                wb_row[section_col - 1] = 'section'
             for n in range(0, 4):
                 if headers[c] == 'f_name' + str(n+1):
                     author_in_col.append(c)
-                    ws.cell(row=wbrow, column=author_col[n], value='author' + str(n+1) + '_fname')
-                    ws.cell(row=wbrow, column=author_col[n] + 1, value='author' + str(n+1) + '_mname')
-                    ws.cell(row=wbrow, column=author_col[n] + 2, value='author' + str(n+1) + '_lname')
-                    ws.cell(row=wbrow, column=author_col[n] + 3, value='author' + str(n+1) + '_suffix')
-                    ws.cell(row=wbrow, column=author_col[n] + 6, value='author' + str(n+1) + '_is_corporate')
-        wbrow += 1
+                    wb_row[author_col[n] - 1] = 'author' + str(n+1) + '_fname'
+                    wb_row[author_col[n]] = 'author' + str(n+1) + '_mname'
+                    wb_row[author_col[n] + 1] = 'author' + str(n+1) + '_lname'
+                    wb_row[author_col[n] + 2] = 'author' + str(n+1) + '_suffix'
+                    wb_row[author_col[n] + 5] = 'author' + str(n+1) + '_is_corporate'
+        ws.append(wb_row)
 
         if debug:
             print(headers)
             print(f'{title_in_col}, {page_in_col}, {author_in_col}')
 
         for row in data_reader:
+            wb_row = [None] * last_col
             if title_flag:
-                ws.cell(row=wbrow, column=title_col, value=row[title_in_col])
+                wb_row[title_col - 1] = row[title_in_col]
             if page_in_col:
-                ws.cell(row=wbrow, column=page_col, value=row[page_in_col])
+                wb_row[page_col - 1] = row[page_in_col]
             if section_in_col:
-                ws.cell(row=wbrow, column=section_col, value=row[section_in_col])
+                wb_row[section_col - 1] = row[section_in_col]
             for n in range(0, 4):
                 try:
                     if author_in_col[n]:
                         try:
-                            ws.cell(row=wbrow, column=author_col[n], value=row[author_in_col[n]])
-                            ws.cell(row=wbrow, column=author_col[n] + 1, value=row[author_in_col[n]+1])
-                            ws.cell(row=wbrow, column=author_col[n] + 2, value=row[author_in_col[n]+2])
-                            ws.cell(row=wbrow, column=author_col[n] + 3, value=row[author_in_col[n]+3])
+                            wb_row[author_col[n] - 1] = row[author_in_col[n]]
+                            wb_row[author_col[n]] = row[author_in_col[n]+1]
+                            wb_row[author_col[n] + 1] = row[author_in_col[n]+2]
+                            wb_row[author_col[n] + 2] = row[author_in_col[n]+3]
                         # Figure out how to get a row number out of this.
                         except IndexError:
                             print(f'Warning: Potentially missing data in row {row}')
                         if row[author_in_col[n]] and row[author_in_col[n]+2]:
-                            ws.cell(row=wbrow, column=author_col[n]+6, value='FALSE')
+                            wb_row[author_col[n] + 5] = 'FALSE'
                         elif row[author_in_col[n]]:
-                            ws.cell(row=wbrow, column=author_col[n]+6, value='TRUE')
+                            wb_row[author_col[n] + 5] = 'TRUE'
                 except IndexError:
                     continue
 
-            wbrow += 1
+            ws.append(wb_row)
 
-    csvfile.close()
     wb.save(filename=dest_filename)
     if verbose:
         print(f'Saving {dest_filename}')
     wb.close()
 
 
-def dirshift(path, verbose, debug, test):
-    # File finder for shiftpage. Allows user to drop all files needing a shifted page and the files containing those
-    # pages into one directory and automatically shift the pages.
-    # TODO: Update to work with any filenames?
-
-    for file in os.listdir(path):
-        # Separate filename from path. Retrieve parts of filename as match groups. This is set to work with the standard
-        # Hein filenames in pattern **_##JournalAbbrev^^^(%%%%-%%%%) *=item number, # = volume number, ^=start page,
-        # % = year(s).
-        filename = os.path.basename(file)
-        fileparts = re.match(r'(\d\d)_(\d{1,2})([A-Za-z]+)([xvi\d\[\]]+)(\(\d{4}-?\d{0,4}\)).pdf', filename)
-        output_file, output_extension = os.path.splitext(file)
-        output_file = output_file + "-NEW" + output_extension
+def indexhein(files):
+    # Take a list of file names (usually one directory listing) and build an index of all of the files with standard
+    # Hein file names. The index
+    # is a dictionary keyed by (item number, volume, year). Each entry is a list of (filename, match) pairs, where match
+    # is the HEIN_FILENAME match object with all the file name parts. The journal name isn't part of the key, because
+    # the regular expression can pull the start of a roman numeral page number into the journal name. Use the
+    # journal name from the match to check the entries instead.
+    hein_index = {}
+    for file in files:
+        fileparts = HEIN_FILENAME.match(os.path.basename(file))
+        if fileparts:
+            key = (int(fileparts.group(1)), fileparts.group(2), fileparts.group(5))
+            hein_index.setdefault(key, []).append((file, fileparts))
+    return hein_index
+
+
+def findshifts(path, debug):
+    # Find the files in a directory that need a shifted page, for dirshift. A file needs one if there is a file with
+    # the next item number and the same journal, volume and year. Returns a list of sequences of file names, each in
+    # item number order, where every file but the last gets the first page of the file after it. The directory is
+    # read once and indexed by indexhein, so finding the next file for each file is a dictionary lookup.
+    files = os.listdir(path)
+    hein_index = indexhein(files)
+    next_files = {}
+    for file in sorted(files):
+        # Retrieve parts of filename as match groups. This is set to work with the standard Hein filenames in pattern
+        # **_##JournalAbbrev^^^(%%%%-%%%%) *=item number, # = volume number, ^=start page, % = year(s).
+        fileparts = HEIN_FILENAME.match(os.path.basename(file))
         if debug:
-            print(f'{filename}, {fileparts}')
+            print(f'{file}, {fileparts}')
         # If there is a match, add one to the item number, then reassemble the file name with a wildcard for the page
-        # number. Look for a file that matches this file name. If this file is found, then assign it as the second
-        # file and send both to shiftpage.
+        # number. Look up the files with the next item number in the index and check them against this file name.
         if fileparts:
-            item_number = int(fileparts.group(1))
-            item_number += 1
-            if item_number > 9:
-                item_number = str(item_number)
-            else:
-                item_number = "0" + str(item_number)
-            filetest = item_number + '_' + fileparts.group(2) + fileparts.group(3) + '*' + fileparts.group(5) + '.pdf'
-            print(filetest)
-            for f in os.listdir(path):
+            item_number = int(fileparts.group(1)) + 1
+            filetest = f'{item_number:02d}_{fileparts.group(2)}{fileparts.group(3)}*{fileparts.group(5)}.pdf'
+            if debug:
+                print(filetest)
+            for f, next_parts in sorted(hein_index.get((item_number, fileparts.group(2), fileparts.group(5)), [])):
                 if fnmatch.fnmatch(f, filetest):
-                    second_file = f
-                    if test:
-                        print(f'First file: {file}; Second file: {second_file}')
-                    else:
-                        shiftpage(os.path.join(path, file), os.path.join(path, second_file),
-                                  os.path.join(path, output_file), verbose)
+                    next_files[file] = f
+                    break
+
+    # Chain the pairs into sequences, starting from each file that isn't the next file for another one. Two files can
+    # have the same next file (two files with the same item number), so keep track of the files already shifted. A
+    # sequence that runs into one of them ends there, and only reads its first page. Every file is shifted once, and
+    # no two sequences write the same output.
+    sequences = []
+    shifted = set()
+    for file in sorted(set(next_files) - set(next_files.values())):
+        sequence = [file]
+        while sequence[-1] in next_files and sequence[-1] not in shifted:
+            shifted.add(sequence[-1])
+            sequence.append(next_files[sequence[-1]])
+        sequences.append(sequence)
+    return sequences
+
+
+def shiftsequence(path, sequence, verbose):
+    # Shift pages along one sequence of files from findshifts, writing <file>-NEW.pdf for every file but the last.
+    # Each file is opened and parsed once. Its reader is used for the first page at the end of the previous file's
+    # output, then kept for its own output. Returns the list of files written.
+    outputs = []
+    input_pdf = None
+    next_pdf = open(os.path.join(path, sequence[0]), 'rb')
+    try:
+        next_reader = PyPDF2.PdfFileReader(next_pdf, strict=False)
+        for file, next_file in zip(sequence, sequence[1:]):
+            input_pdf, pdf_reader = next_pdf, next_reader
+            next_pdf = open(os.path.join(path, next_file), 'rb')
+            next_reader = PyPDF2.PdfFileReader(next_pdf, strict=False)
+
+            output_file, output_extension = os.path.splitext(file)
+            output_file = os.path.join(path, output_file + "-NEW" + output_extension)
+            if verbose:
+                print(f'Adding the first page of {next_file} to {file}')
+            with MergeWriter(output_file, pdfversion([input_pdf.name, next_pdf.name])) as pdf_writer:
+                pdf_writer.appendreader(pdf_reader)
+                pdf_writer.appendreader(next_reader, [0])
+            outputs.append(output_file)
+            input_pdf.close()
+    finally:
+        next_pdf.close()
+        if input_pdf:
+            input_pdf.close()
+    return outputs
+
+
+def dirshift(path, verbose, debug, test, jobs=1):
+    # File finder for shiftpage. Allows user to drop all files needing a shifted page and the files containing those
+    # pages into one directory and automatically shift the pages.
+    # TODO: Update to work with any filenames?
+    #
+    # The files are found by findshifts, and each sequence of files is shifted in one pass by shiftsequence, so every
+    # file is only parsed once instead of once on each side of a pair. With jobs above 1, the sequences are cut into
+    # pieces for that many worker processes. Neighbouring pieces share one file, which is parsed once in each.
+    # Returns the list of files written.
+
+    start_time = time.perf_counter()
+    sequences = findshifts(path, debug)
+    shifts = sum(len(sequence) - 1 for sequence in sequences)
+    scan_time = time.perf_counter() - start_time
+    if verbose:
+        print(f'Found {shifts} files to shift in {len(sequences)} sequences in {scan_time:.3f} seconds')
+
+    if test:
+        for sequence in sequences:
+            for file, next_file in zip(sequence, sequence[1:]):
+                print(f'First file: {file}; Second file: {next_file}')
+        return []
+
+    start_time = time.perf_counter()
+    piece_size = max(1, -(-shifts // jobs))
+    pieces = []
+    for sequence in sequences:
+        for start in range(0, len(sequence) - 1, piece_size):
+            pieces.append(sequence[start:start + piece_size + 1])
+    outputs = []
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(shiftsequence, path, piece, verbose) for piece in pieces]
+            for future in futures:
+                outputs.extend(future.result())
+    else:
+        for piece in pieces:
+            outputs.extend(shiftsequence(path, piece, verbose))
+    shift_time = time.perf_counter() - start_time
+    if verbose:
+        print(f'Shifted {len(outputs)} files in {shift_time:.3f} seconds')
+    return outputs
 
 
 def getfilenames(input_file, debug):
@@ -576,6 +1631,9 @@ def getfilenames(input_file, debug):
     # It takes an input file (the first file), then looks for a file with an item number (the first part of the
     # filename) one higher. If it finds one, it adds it to a list. Then it looks for one higher than that. Once
     # there are no more, it passes the list to combinepdf.
+    #
+    # The directory is only listed once. indexhein builds an index of the Hein files in it, so each step of the
+    # search is a dictionary lookup instead of another directory listing.
 
     file_names = []
     input_path, input_filename = os.path.split(input_file)
@@ -583,13 +1641,14 @@ def getfilenames(input_file, debug):
     # Assign input filename parts to match groups. This is set to work with the standard
     # Hein file names in pattern **_##JournalAbbrev^^^(%%%%-%%%%) *=item number, # = volume number, ^=start page,
     # % = year(s).
-    file_parts = re.match(r'(\d\d)_(\d{1,2})([A-Za-z]+)([xvi\d\[\]]+)(\(\d{4}-?\d{0,4}\)).pdf', input_filename)
+    file_parts = HEIN_FILENAME.match(input_filename)
     if debug:
         print(f'{input_filename}, {file_parts}')
         for r in range(0, file_parts.lastindex):
             print(file_parts.group(r))
-    # Loop through each file in the directory looking for a match. If there's a match, add to file_names list
+    # Index the directory and look up each item number in the index. If there's a match, add to file_names list
     if file_parts:
+        hein_index = indexhein(os.listdir(input_path or '.'))
         # Set flag. Set the item number to the number from the input file.
         newfile = False
         item_number = int(file_parts.group(1))
@@ -615,14 +1674,14 @@ def getfilenames(input_file, debug):
             else:
                 print('No matching files found.')
                 file_test = ''
-            # Step through directory pulled from the input file. Check each file against the test file name. If there's
-            # a match, append the name to file_names list. Set the newfile flag to true, so the routine knows that
-            # at least one file was found.
-            for f in os.listdir(input_path):
+            # Check each file in the index with this item number, volume and year against the test file name. If
+            # there's a match, append the name to file_names list. Set the newfile flag to true, so the routine knows
+            # that at least one file was found.
+            for f, parts in hein_index.get((item_number, file_parts.group(2), file_parts.group(5)), []):
                 if fnmatch.fnmatch(f, file_test):
                     file_names.append(os.path.join(input_path, f))
                     newfile = True
-            # After directory checked, if there was a file match, add one to the item number. If there was no match,
+            # After the index is checked, if there was a file match, add one to the item number. If there was no match,
             # set the item number to zero, so the loop ends.
             if newfile:
                 item_number += 1
@@ -633,32 +1692,89 @@ def getfilenames(input_file, debug):
         return file_names
 
 
-def capitalize_title(title):
-    # Change case of common prepositions and conjunctions to lower case for more accurate headline style capitalization
-    title = re.sub(r'(?<!:.)\sAnd\s', ' and ', title)
-    title = re.sub(r'(?<!:.)\sBut\s', ' but ', title)
-    title = re.sub(r'(?<!:.)\sOf\s', ' of ', title)
-    title = re.sub(r'(?<!:.)\sFor\s', ' for ', title)
-    title = re.sub(r'(?<!:.)\sOr\s', ' or ', title)
-    title = re.sub(r'(?<!:.)\sNor\s', ' nor ', title)
-    title = re.sub(r'(?<!:.)\sA\s', ' A ', title)
-    title = re.sub(r'(?<!:.)\sAn\s', ' an ', title)
-    title = re.sub(r'(?<!:.)\sThe\s', ' the ', title)
-    title = re.sub(r'(?<!:.)\sTo\s', ' to ', title)
-    title = re.sub(r'(?<!:.)\sAs\s', ' as ', title)
-    title = re.sub(r'(?<!:.)\sIn\s', ' in ', title)
-    title = re.sub(r'(?<!:.)\sWith\s', ' with ', title)
-    title = re.sub(r'(?<!:.)\sAt\s', ' at ', title)
-    title = re.sub(r'(?<!:.)\sFrom\s', ' from ', title)
-    title = re.sub(r'(?<!:.)\sInto\s', ' into ', title)
-    title = re.sub(r'(?<!:.)\sOn\s', ' on ', title)
-    title = re.sub(r'(?<!:.)\sIn\s', ' in ', title)
-    title = re.sub(r'(?<!:.)\sBy\s', ' by ', title)
-    title = re.sub(r'(?<!:.)\sUp\s', ' up ', title)
-    title = re.sub(r'(?<!:.)\sOut\s', ' out ', title)
+def heinjournal(fileparts):
+    # Return the journal name from a HEIN_FILENAME match, for grouping files by journal. The journal group can pull in
+    # the start of a roman numeral page number (BuffLRevxii gives BuffLRevxi), so any trailing x, v and i are dropped.
+    # That can take letters off of the real name too (BuffLRev becomes BuffLRe), but it does the same to every file of
+    # a journal, so they still group together.
+    return fileparts.group(3).rstrip('xvi')
+
+
+def getruns(path, debug):
+    # Find every run of consecutive Hein files in a directory, for combining a whole directory at once. The directory
+    # is listed once and indexed by indexhein. Files are grouped by journal, volume and year, and each group is split
+    # into runs wherever there is a gap in the item numbers. Returns a list of runs, and each run is a list of file
+    # paths in item number order. Runs of only one file are left out, since there is nothing to combine. If two files
+    # of a journal have the same item number, the first one by name is used and the other is left out with a warning.
+    hein_index = indexhein(os.listdir(path))
+
+    # Collect the files for each journal, volume and year by item number. The volume number is in the key twice, so
+    # the volumes sort by number but the original string is still there.
+    volumes = {}
+    for (item_number, volume, year), files in hein_index.items():
+        for f, parts in sorted(files):
+            items = volumes.setdefault((heinjournal(parts), int(volume), volume, year), {})
+            if item_number in items:
+                print(f'WARNING! {f} has the same item number as {items[item_number]}. Leaving it out.')
+            else:
+                items[item_number] = f
+
+    runs = []
+    for key in sorted(volumes):
+        items = volumes[key]
+        run = []
+        previous_item = None
+        for item_number in sorted(items):
+            # Start a new run if there's a gap in the item numbers.
+            if run and item_number != previous_item + 1:
+                if len(run) > 1:
+                    runs.append(run)
+                run = []
+            run.append(os.path.join(path, items[item_number]))
+            previous_item = item_number
+        if len(run) > 1:
+            runs.append(run)
+
+    if debug:
+        for run in runs:
+            print(run)
+    return runs
+
+
+@functools.lru_cache(maxsize=None)
+def titlepattern(stop_words):
+    # Build the regular expression used by capitalize_title for a tuple of stop words. It matches a run of one or more
+    # stop words with whitespace on both sides, unless the run comes right after a colon (the first word after a
+    # colon stays capitalized). Runs are matched whole, so stop words next to each other (Of The) share the spaces
+    # between them. TITLE_KEEP_WORDS are matched too. The pattern is only built once for each set of stop words.
+    words = [word.capitalize() for word in stop_words] + list(TITLE_KEEP_WORDS)
+    words = '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+    return re.compile(r'(?<!:.)\s((?:(?:' + words + r')\s)+)')
+
+
+def lowerwords(match):
+    # Replacement for titlepattern matches. Lower case every word in the run except TITLE_KEEP_WORDS, and put single
+    # spaces around each one.
+    words = [word if word in TITLE_KEEP_WORDS else word.lower() for word in match.group(1).split()]
+    return ' ' + ' '.join(words) + ' '
+
+
+def fixtitle(match):
+    # Replacement for TITLE_FIXES matches. Drop the space after a hyphen and lower case the next letter, or lower case
+    # the S in 'S.
+    if match.group(1):
+        return match.group(1).lower()
+    return "'s"
+
+
+def capitalize_title(title, stop_words=TITLE_STOP_WORDS):
+    # Change case of common prepositions and conjunctions to lower case for more accurate headline style
+    # capitalization. All of the stop words are done in one pass with one regular expression (see titlepattern).
+    # Pass a different tuple of stop_words to change the list. Unlike the old one re.sub per word version, the same stop
+    # word twice in a row is lower cased both times ("Of Of" gives "of of", not "of Of").
+    title = titlepattern(tuple(stop_words)).sub(lowerwords, title)
     # Fix hyphenated words and 'S
-    title = re.sub(r'- ([A-Z])', lambda x: x.group(1).lower(), title)
-    title = re.sub(r'\'S', '\'s', title)
+    title = TITLE_FIXES.sub(fixtitle, title)
     return title
 
 
@@ -693,3 +1809,574 @@ def dateconvert(year, month=''):
     date = str(year) + '-' + month + '-01'
 
     return date
+
+
+def cleantitle(title_parts, join_lines=False):
+    # Join the title lines found on a page together. Strip extra spaces and use title capitalization. If join_lines
+    # is set, line breaks inside the parts are changed to spaces first. Any word with an apostrophe comes out with a
+    # space before the apostrophe and the next letter capitalized. Fix in a future version.
+    temp_title = ' '.join(title_parts)
+    if join_lines:
+        temp_title = temp_title.replace('\n', ' ')
+    temp_title = temp_title.strip()
+    temp_title = MULTIPLE_SPACES.sub(' ', temp_title)
+    temp_title = temp_title.title()
+    return capitalize_title(temp_title)
+
+
+def authorlist(names):
+    # Split up to four author names with splitname and return them as a list of four tuples. Missing authors are
+    # filled in with empty strings, which is the format exportcsvnew expects.
+    author_list = []
+    for count in range(0, 4):
+        try:
+            f_name, m_name, l_name, suffix = splitname(names[count])
+            author_temp = f_name, m_name, l_name, suffix
+        except IndexError:
+            author_temp = '', '', '', ''
+        author_list.append(author_temp)
+    return author_list
+
+
+# Character classes counted for each line by linefeatures. Anything not in one of these is counted as other.
+LINE_CHARACTERS = {
+    'upper': string.ascii_uppercase,
+    'lower': string.ascii_lowercase,
+    'digit': string.digits,
+    'space': ' ',
+    'period': '.',
+    'punct': ':"\'-',
+    'section': '§',
+}
+# linefeatures translates the whole page with LINE_TABLE, which swaps each character in LINE_CHARACTERS for a control
+# character standing for its class (and any of those control characters already in the text for a NUL), so that the
+# count for each class on each line is a single str.count.
+LINE_CODES = {name: chr(code) for code, name in enumerate(LINE_CHARACTERS, 1)}
+LINE_TABLE = str.maketrans({**{chr(code): '\0' for code in range(1, len(LINE_CODES) + 1)},
+                            **{character: LINE_CODES[name] for name, characters in LINE_CHARACTERS.items()
+                               for character in characters}})
+# And OTHER_TABLE deletes every character in LINE_CHARACTERS, leaving only the other characters (and line breaks).
+OTHER_TABLE = str.maketrans('', '', ''.join(LINE_CHARACTERS.values()))
+
+# Token shapes for linefeatures: each run of upper case letters becomes A, lower case a and digits 9. Everything else
+# is kept, so "Mary B. Davis" is "Aa A. Aa" and "XLII." is "A.".
+SHAPE_TABLE = str.maketrans(string.ascii_uppercase + string.ascii_lowercase + string.digits,
+                            'A' * 26 + 'a' * 26 + '9' * 10)
+SHAPE_RUNS = re.compile(r'(?<=A)A+|(?<=a)a+|(?<=9)9+')
+
+# Every feature linefeatures can work out.
+LINE_FEATURES = ['length', *LINE_CHARACTERS, 'other', 'upper_ratio', 'digit_only', 'tokens', 'blank_before',
+                 'blank_after', 'first', 'last', 'shape']
+
+# Line classes for classifylines. Each class is a set of thresholds on the features from linefeatures, as (minimum,
+# maximum) pairs, with None for no limit. A line is in the class if every feature is within its limits. The yes/no
+# features are 1 or 0.
+#
+# page_number: A printed page number. A line of one to four digits and nothing else.
+# caps_line: An all caps title line, with no lower case letters or digits. Only spaces and .:"'-§ are allowed besides
+#     the capitals. It can't be the first line of the page or the last one (they don't count as whole lines).
+# caps_line_plain: The same as caps_line, without . or §.
+LINE_CLASSES = {
+    'page_number': {'digit_only': (1, 1), 'length': (1, 4)},
+    'caps_line': {'lower': (0, 0), 'length': (3, None), 'digit': (0, 0), 'other': (0, 0), 'first': (0, 0),
+                  'last': (0, 0)},
+    'caps_line_plain': {'lower': (0, 0), 'length': (3, None), 'digit': (0, 0), 'other': (0, 0), 'period': (0, 0),
+                        'section': (0, 0), 'first': (0, 0), 'last': (0, 0)},
+}
+
+
+def linefeatures(text, names=None):
+    # Split a page into lines once and work out the features of every line for classifylines. Returns the list of
+    # lines and a dictionary of features, each one a list (or a NumPy array, if NumPy is installed) with one value per
+    # line. Only the features in names are worked out, or all of them if names is None:
+    #
+    # length: Number of characters.
+    # upper, lower, digit, space, period, punct, section: Number of characters of each kind (see LINE_CHARACTERS).
+    # other: Number of characters of any other kind.
+    # upper_ratio: Share of the letters that are capitals, or 0 if there are no letters.
+    # digit_only: 1 if the line is all digits.
+    # tokens: Number of words.
+    # blank_before, blank_after: 1 if the line before or after is blank.
+    # first, last: 1 for the first line on the page, and for the last line if the page doesn't end with a line break.
+    # shape: The token shape of the line (see SHAPE_TABLE), as a string.
+    lines = text.split('\n')
+    count = len(lines)
+    wanted = set(LINE_FEATURES if names is None else names)
+
+    # Character counts. upper_ratio is worked out from the upper and lower counts.
+    counted = wanted & set(LINE_CODES)
+    if 'upper_ratio' in wanted:
+        counted |= {'upper', 'lower'}
+    features = {}
+    if 'length' in wanted:
+        features['length'] = list(map(len, lines))
+    if counted:
+        coded = text.translate(LINE_TABLE).split('\n')
+        for name, code in LINE_CODES.items():
+            if name in counted:
+                features[name] = list(map(str.count, coded, itertools.repeat(code)))
+    if 'other' in wanted:
+        features['other'] = list(map(len, text.translate(OTHER_TABLE).split('\n')))
+    if 'upper_ratio' in wanted:
+        features['upper_ratio'] = [upper / (upper + lower) if upper + lower else 0
+                                   for upper, lower in zip(features['upper'], features['lower'])]
+
+    # Everything else.
+    if 'digit_only' in wanted:
+        features['digit_only'] = list(map(int, map(str.isdecimal, lines)))
+    if 'tokens' in wanted:
+        features['tokens'] = [len(line.split()) for line in lines]
+    if wanted & {'blank_before', 'blank_after'}:
+        blank = [int(not line) for line in lines]
+        features['blank_before'] = [0] + blank[:-1]
+        features['blank_after'] = blank[1:] + [0]
+    if 'first' in wanted:
+        features['first'] = [1] + [0] * (count - 1)
+    if 'last' in wanted:
+        features['last'] = [0] * (count - 1) + [1]
+    if 'shape' in wanted:
+        features['shape'] = SHAPE_RUNS.sub('', text.translate(SHAPE_TABLE)).split('\n')
+    features = {name: values for name, values in features.items() if name in wanted}
+    if numpy is not None:
+        features = {name: numpy.array(values) for name, values in features.items()}
+    return lines, features
+
+
+def classifylines(text, classes):
+    # Classify every line of a page at once. Returns a dictionary with the lines in each of the named LINE_CLASSES, in
+    # the order they appear on the page. The features are only worked out once, however many classes there are, and
+    # only the ones the classes use.
+    names = {feature for name in classes for feature in LINE_CLASSES[name]}
+    lines, features = linefeatures(text, names)
+    classified = {}
+    for name in classes:
+        if numpy is not None:
+            mask = numpy.ones(len(lines), dtype=bool)
+            for feature, (low, high) in LINE_CLASSES[name].items():
+                if low is not None:
+                    mask &= features[feature] >= low
+                if high is not None:
+                    mask &= features[feature] <= high
+            classified[name] = [lines[i] for i in numpy.flatnonzero(mask)]
+        else:
+            # Narrow down a list of line numbers one threshold at a time, so later ones only check what's left.
+            keep = range(len(lines))
+            for feature, (low, high) in LINE_CLASSES[name].items():
+                values = features[feature]
+                if low == high:
+                    keep = [i for i in keep if values[i] == low]
+                elif high is None:
+                    keep = [i for i in keep if values[i] >= low]
+                elif low is None:
+                    keep = [i for i in keep if values[i] <= high]
+                else:
+                    keep = [i for i in keep if low <= values[i] <= high]
+            classified[name] = [lines[i] for i in keep]
+    return classified
+
+
+# Rule profiles for extractmetadata, one for each of the dsplit files. Each profile is a dictionary of precompiled
+# regular expressions and settings:
+#
+# A title or start_page rule can also be the name of one of the LINE_CLASSES instead of a regular expression. All of
+# the line classes a profile uses are worked out in one pass over the lines of each page by classifylines. caps_line,
+# caps_line_plain and page_number find exactly the same lines as the regular expressions they replaced (the old rd
+# title, coa-new title and PAGE_NUMBER rules).
+#
+# title: Finds title lines on a page (findall). Everything it returns is joined into one title with cleantitle, and
+#     a title longer than five characters starts a new piece. In a profile with a toc rule, title only has to find
+#     something (search) on the page where each piece starts.
+# author: Finds author lines on a page (findall). None to skip the author search.
+# start_page: Finds the printed page number on the first page of a piece (search). None to skip.
+# toc: Finds the entries in a table of contents on PDF page 0 (finditer), with named groups for the title and
+#     author. The titles and authors come from here instead of the pages. None if there is no table of contents.
+# join_lines: Change line breaks in title parts to spaces before joining them.
+# end_page: Where a piece ends. 'author' ends it on the page where the author is found. 'next_title' ends it on the
+#     page where the next piece starts, and the last piece on the last page.
+# close_last: With end_page 'author', end the last piece on the last page if no author was found for it.
+#
+# To set up a new journal series, copy the closest profile, add it here under a new name and tweak the rules.
+#
+# RULES_VERSION is saved in the manifest along with a hash of the profile (see ruleshash). Changing a profile is
+# picked up automatically, but bump RULES_VERSION after a change to extractmetadata itself so that --incremental
+# runs redo every file.
+RULES_VERSION = 2
+PROFILES = {
+    # Recent decisions or case notes: all caps title at the top, then the text, then the author's name.
+    'rd': {
+        'title': 'caps_line',
+        'author': re.compile(
+            r'(?<=\n)[A-Z][A-Za-z]*\.? +[A-Z][a-z]*\.? +[A-Za-z]+\.?[,. A-Za-z]{0,6}(?=\n)|'
+            r'(?<=\n)[A-Z][A-Za-z]+ +[A-Z][a-z]+[,. A-Za-z]{0,6}(?=\n)|'
+            r'(?<=\n)[A-Z][A-Za-z]*\.? +[A-Z][a-z]*\.? +[A-Za-z]+\.? +[A-Za-z]+\.?[,. A-Za-z]{0,6}(?=\n)'),
+        'start_page': 'page_number',
+        'toc': None,
+        'join_lines': False,
+        'end_page': 'author',
+        'close_last': False,
+    },
+    # Recent decisions with titles limited to 100 characters between blank lines, for scans where random paragraphs
+    # were being picked up as titles.
+    'rd-alt': {
+        'title': re.compile(r'(?<=\n\n)[A-Za-z .:"\'\-\n]{3,100}(?=\n\n)'),
+        'author': re.compile(
+            r'(?<=\n)[A-Z][A-Za-z]*\.? +[A-Z][a-z]*\.? +[A-Za-z]+\.?[,. A-Za-z]{0,6}(?=\n)|'
+            r'(?<=\n)[A-Z][A-Za-z]+ +[A-Z][a-z]+[,. A-Za-z]{0,6}(?=\n)|'
+            r'(?<=\n)[A-Z][A-Za-z]*\.? +[A-Z][a-z]*\.? +[A-Za-z]+\.? +[A-Za-z]+\.?[,. A-Za-z]{0,6}(?=\n)'),
+        'start_page': 'page_number',
+        'toc': None,
+        'join_lines': False,
+        'end_page': 'author',
+        'close_last': False,
+    },
+    # Book reviews: the title and "By" line of the book at the top, then the text, then the reviewer.
+    'br': {
+        'title': re.compile(r'(?<=\n)[A-Z][A-Za-z0-9 .,():"\'\-]{3,}\.(?=\s+By)|'
+                            r'By\s{1,2}[A-Za-z \-,&.]+\.'),
+        'author': re.compile(
+            r'(?<=\n)[A-Z][A-Za-z]*\.? +[A-Z][A-Za-z]*\.? +[A-Za-z]+\.?[,. A-Za-z]{0,6}\*?(?=\n)|'
+            r'(?<=\n)[A-Z][A-Za-z]+ +[A-Z][a-z]+[,. A-Za-z]{0,6}\*?(?=\n)|'
+            r'(?<=\n)[A-Z][A-Za-z]*\.? *[A-Z][a-z]*\.? +[A-Za-z]+\.? +[A-Za-z]+\.?[,. A-Za-z]{0,6}\*?(?=\n)'),
+        'start_page': 'page_number',
+        'toc': None,
+        'join_lines': True,
+        'end_page': 'author',
+        'close_last': True,
+    },
+    # Middle-period Court of Appeals case notes. Some are unsigned, so each piece ends where the next one starts.
+    # The authors here are initials.
+    'coa-new': {
+        'title': 'caps_line_plain',
+        'author': re.compile(
+            r'(?<=\n)[A-Z].\s{0,2}[A-Z].\s{0,2}[A-Z]\s{0,2}[,. A-Za-z]{0,6}(?=\n)|'
+            r'(?<=\n)[A-Z].\s{0,2}[A-Z].[,. A-Za-z]{0,6}(?=\n)|'
+            r'(?<=\n)Bd. {0,2}(?=\n)'),
+        'start_page': 'page_number',
+        'toc': None,
+        'join_lines': False,
+        'end_page': 'next_title',
+        'close_last': False,
+    },
+    # Early Court of Appeals case notes. Titles and authors come from the table of contents on the first page, and
+    # each section starts at a roman numeral heading. The printed page numbers didn't come through on these.
+    'coa': {
+        'title': re.compile(r'(?<=\n)([XIVHLlixv]{1,4}\.)\s([A-Za-z0-9.,*\- ]*)\s(?=\n)'),
+        'author': None,
+        'start_page': None,
+        'toc': re.compile(r'([IVXL]{1,4}\.?)\s(?P<title>[A-Za-z0-9., ]+)\s(\((?P<author>[A-Za-z ]{5,})\))?',
+                          re.DOTALL),
+        'join_lines': False,
+        'end_page': 'next_title',
+        'close_last': False,
+    },
+}
+
+
+def extractmetadata(pages, profile, verbose, debug):
+    # This is the main processing function for the dsplit files. It looks through each page passed to it and tries to
+    # pull as much metadata as it can find, using the rules in profile (see PROFILES). pages is anything that gives
+    # (page_number, text) pairs, like iter_pdf_pages. Every rule is compiled once, and each one is run only once per
+    # page. Rules that are line classes are all worked out together by one call to classifylines for each page.
+
+    # Create lists for all values to be exported to CSV file. Each index value will correspond to the metadata
+    # for one article across all lists.
+    title = []
+    author = []
+    start_page = []
+    start_pdf_page = []
+    end_pdf_page = []
+    page_number = 0
+    pages = iter(pages)
+
+    title_rule = profile['title']
+    author_rule = profile['author']
+    start_page_rule = profile['start_page']
+    toc_rule = profile['toc']
+    end_at_title = profile['end_page'] == 'next_title'
+    line_classes = [rule for rule in (title_rule, start_page_rule) if isinstance(rule, str)]
+    lines = {}
+
+    # Get titles and authors from the table of contents on the first page. Take the first page off of pages here, so
+    # the loop below starts on the second page. The table of contents is PDF page 0. If pages starts later (a page
+    # selection without page 0), put the page back and go on without the table of contents.
+    if toc_rule:
+        page_number, toc_text = next(pages, (0, ''))
+        if page_number != 0:
+            print('WARNING! The first PDF page was not read, so there is no table of contents.')
+            pages = itertools.chain([(page_number, toc_text)], pages)
+            toc_text = ''
+        for r, entry in enumerate(toc_rule.finditer(toc_text)):
+            if 0 < debug < 3:
+                print(f'Record {r}, {entry.groups()}')
+            title.append(cleantitle([entry.group('title')]))
+            find_author = MULTIPLE_SPACES.sub(' ', entry.group('author') or '')
+            author.append(authorlist(re.split(r' and ', find_author, 2)))
+            start_page.append('')
+            if 1 < debug < 5:
+                print(f'{title[r]}, {author[r]}')
+
+    # Process each page. Step through pages and attempt to find titles, authors, and page numbers in OCR text.
+    # Store this metadata and the start and end pages of each article into lists.
+    if verbose:
+        print('Processing PDF pages')
+
+    for page_number, text in pages:
+
+        if 0 < debug < 6:
+            print('Processing PDF page number %d' % page_number)
+        if line_classes:
+            lines = classifylines(text, line_classes)
+
+        # Look for the start of a piece on this page. With a table of contents, the titles are already known, so
+        # any match is enough. Otherwise, join everything the title rule finds into a title. If the title is more
+        # than five characters long, append it to the title list. This should be enough to get rid of garbage lines,
+        # but short enough to keep short ones.
+        new_piece = False
+        if toc_rule:
+            if isinstance(title_rule, str):
+                title_parts = lines[title_rule] or None
+            else:
+                title_parts = title_rule.search(text)
+            new_piece = title_parts is not None
+            if 1 < debug < 5 and title_parts:
+                print('Title parts: %s' % title_parts)
+        else:
+            if isinstance(title_rule, str):
+                title_parts = lines[title_rule]
+            else:
+                title_parts = title_rule.findall(text)
+            if 1 < debug < 5 and title_parts:
+                print('Title parts: %s' % title_parts)
+            temp_title = cleantitle(title_parts, profile['join_lines'])
+            # Print processed title at debug levels 1-4.
+            if 0 < debug < 5 and temp_title:
+                print('TITLE: %s' % temp_title)
+            if len(temp_title) > 5:
+                new_piece = True
+                title.append(temp_title)
+                # Look for original page number in OCR text, and if found append to start_page list. If not, append
+                # placeholder string. A line class gives a list of lines, so take the first one like search would.
+                if start_page_rule:
+                    if isinstance(start_page_rule, str):
+                        original_page_number = lines[start_page_rule][:1]
+                    else:
+                        original_page_number = start_page_rule.search(text)
+                    if original_page_number:
+                        start_page.append(original_page_number[0])
+                    else:
+                        start_page.append(" ")
+                    if 0 < debug < 5:
+                        if original_page_number:
+                            print('Start page in PDF text: %s' % original_page_number[0])
+                        else:
+                            print('No start page found in PDF text')
+                else:
+                    start_page.append('')
+
+        # Append the page number of the PDF file to start_pdf_page list. If pieces end where the next one starts,
+        # append it to end_pdf_page for the previous piece too (this will have to be hand-corrected in cases where
+        # the piece ended on the previous page).
+        if new_piece:
+            start_pdf_page.append(page_number)
+            if end_at_title and len(start_pdf_page) > 1:
+                end_pdf_page.append(page_number)
+
+        # Find authors. If any lines are returned, split up to four of them into names. If pieces end at the author,
+        # append the current PDF page to end_pdf_page. If pieces end at the next title, an author list is added for
+        # every page, with empty strings if none were found.
+        if author_rule:
+            find_author = author_rule.findall(text)
+            if find_author:
+                author.append(authorlist(find_author))
+                if not end_at_title:
+                    end_pdf_page.append(page_number)
+            elif end_at_title:
+                author.append(authorlist([]))
+            if 0 < debug < 5:
+                print('Author: %s' % find_author)
+        if 1 < debug < 5:
+            print(f'PDF start pages: {start_pdf_page}')
+            print(f'PDF end pages: {end_pdf_page}')
+
+    # Add the last page to end_pdf_page for the last piece, because the loop ended before the page was added.
+    if end_at_title or (profile['close_last'] and len(start_pdf_page) > len(end_pdf_page)):
+        end_pdf_page.append(page_number)
+
+    # Compare lists to see if they contain the same number of values. If not, then pad out the short lists with
+    # empty values and throw a warning.
+    if toc_rule:
+        if len(title) < len(start_pdf_page):
+            for r in range(len(title), len(start_pdf_page)):
+                title.append('')
+                author.append(authorlist([]))
+                start_page.append('')
+            print('WARNING! Missing titles and authors from the table of contents')
+        if len(start_pdf_page) < len(title):
+            for r in range(len(start_pdf_page), len(title)):
+                start_pdf_page.append(0)
+            print('WARNING! Missing Start PDF Page(s)')
+        if len(end_pdf_page) < len(title):
+            for r in range(len(end_pdf_page), len(title)):
+                end_pdf_page.append(0)
+            print('WARNING! Missing End PDF Page(s)')
+    elif not end_at_title:
+        # Evaluation is in two groups: The values updated when a title is found, and the values updated when an
+        # author is found.
+        if len(title) > len(author):
+            print('WARNING! Missing authors and ending PDF pages')
+            for r in range(len(author), len(title)):
+                author.append(authorlist([]))
+                end_pdf_page.append(0)
+        elif len(author) > len(title):
+            print('WARNING! Missing titles, start pages, and starting PDF pages')
+            for r in range(len(title), len(author)):
+                title.append('')
+                start_page.append('')
+                start_pdf_page.append(0)
+
+    # Lots of debugging output
+    # Print all of the lists; debug levels 2 & 4
+    if debug == 2 or debug == 4:
+        print('\n\nAll list values:')
+        print(title)
+        print(author)
+        print(start_page)
+        print(start_pdf_page)
+        print(end_pdf_page)
+    # step through each record and print all contents; debug level 6
+    if debug == 6:
+        print('\n\nAll records:')
+        for r in range(0, len(title)):
+            print(f'Record {r}: {title[r]}; {author[r]}; {start_page[r]}; {start_pdf_page[r]};'
+                  f' {end_pdf_page[r]}')
+
+    # Return all collected metadata lists.
+    return title, start_page, start_pdf_page, end_pdf_page, author
+
+
+def ruleshash(profile):
+    # Return a short hash of a rule profile and RULES_VERSION, for the manifest.
+    rules = {}
+    for name, rule in profile.items():
+        if isinstance(rule, re.Pattern):
+            rule = [rule.pattern, rule.flags]
+        elif isinstance(rule, str) and rule in LINE_CLASSES:
+            rule = [rule, LINE_CLASSES[rule]]
+        rules[name] = rule
+    rules = json.dumps({'rules': rules, 'version': RULES_VERSION}, sort_keys=True)
+    return hashlib.sha256(rules.encode('utf-8')).hexdigest()[:16]
+
+
+class Profiler:
+    # Timing for the --profile option on the command-line tools. Wrap each step of a tool in "with profiler.stage(name)"
+    # and pass page iterators through profiler.pages(name, pages) to time each page as it's read. Stages can be nested.
+    # A stage's own time leaves out the stages and pages inside it, so for a dsplit run the read stage is pdfminer and
+    # the own time of the extract stage around it is the regex work. Memory is the change in the number of blocks
+    # Python has allocated (sys.getallocatedblocks), which is cheap enough to leave on for every page.
+    #
+    # profile is the value of the --profile option: False or None to turn profiling off, True to print a summary table
+    # when report is called, or a file prefix to also write a cProfile dump to <prefix>.pstats and a JSON trace of
+    # every stage and page to <prefix>.json. The cProfile dump only covers the main process, so use --jobs 1 to
+    # profile the pdfminer code itself.
+
+    def __init__(self, profile=None):
+        self.enabled = bool(profile)
+        self.output = profile if isinstance(profile, str) else None
+        self.stages = {}
+        self.page_times = []
+        self.stack = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.profile = None
+        if self.output:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def record(self, name, wall, cpu, blocks, own_wall, own_cpu, pages=0):
+        # Add one call's numbers to the totals for a stage, and take them out of the enclosing stage's own time.
+        totals = self.stages.setdefault(name, {'calls': 0, 'pages': 0, 'wall': 0.0, 'cpu': 0.0, 'own_wall': 0.0,
+                                               'own_cpu': 0.0, 'blocks': 0, 'max_page_wall': 0.0})
+        totals['calls'] += 1
+        totals['pages'] += pages
+        totals['wall'] += wall
+        totals['cpu'] += cpu
+        totals['own_wall'] += own_wall
+        totals['own_cpu'] += own_cpu
+        totals['blocks'] += blocks
+        if pages:
+            totals['max_page_wall'] = max(totals['max_page_wall'], wall)
+        if self.stack:
+            self.stack[-1][3] += wall
+            self.stack[-1][4] += cpu
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # Time everything run inside the with block as stage name.
+        if not self.enabled:
+            yield
+            return
+        entry = [time.perf_counter(), time.process_time(), sys.getallocatedblocks(), 0.0, 0.0]
+        self.stack.append(entry)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            wall = time.perf_counter() - entry[0]
+            cpu = time.process_time() - entry[1]
+            self.record(name, wall, cpu, sys.getallocatedblocks() - entry[2], wall - entry[3], cpu - entry[4])
+
+    def pages(self, name, pages):
+        # Pass pages through, timing how long each one takes to produce as part of stage name. Returns pages unchanged
+        # if profiling is off.
+        if not self.enabled:
+            return pages
+        return self.iterpages(name, pages)
+
+    def iterpages(self, name, pages):
+        # Generator for pages. The time spent in the caller between pages isn't counted.
+        pages = iter(pages)
+        page_number = 0
+        while True:
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+            start_blocks = sys.getallocatedblocks()
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            blocks = sys.getallocatedblocks() - start_blocks
+            self.record(name, wall, cpu, blocks, wall, cpu, pages=1)
+            self.page_times.append({'stage': name, 'page': page_number, 'wall': wall, 'cpu': cpu, 'blocks': blocks})
+            page_number += 1
+            yield page
+
+    def report(self):
+        # Print the summary table, and write the cProfile dump and JSON trace if a file prefix was given.
+        if not self.enabled:
+            return
+        total_wall = time.perf_counter() - self.start_wall
+        total_cpu = time.process_time() - self.start_cpu
+        print(f'\n{"stage":<16}{"calls":>6}{"pages":>7}{"wall s":>9}{"own s":>9}{"cpu s":>9}{"ms/page":>9}'
+              f'{"max ms":>9}{"net blocks":>12}')
+        for name, totals in self.stages.items():
+            per_page = f'{totals["wall"] / totals["pages"] * 1000:.1f}' if totals['pages'] else '-'
+            max_page = f'{totals["max_page_wall"] * 1000:.1f}' if totals['pages'] else '-'
+            print(f'{name:<16}{totals["calls"]:>6}{totals["pages"]:>7}{totals["wall"]:>9.3f}{totals["own_wall"]:>9.3f}'
+                  f'{totals["cpu"]:>9.3f}{per_page:>9}{max_page:>9}{totals["blocks"]:>12}')
+        print(f'{"total":<16}{"":>6}{"":>7}{total_wall:>9.3f}{"":>9}{total_cpu:>9.3f}')
+
+        if self.output:
+            self.profile.disable()
+            self.profile.dump_stats(self.output + '.pstats')
+            trace = {
+                'argv': sys.argv,
+                'wall': total_wall,
+                'cpu': total_cpu,
+                'stages': self.stages,
+                'pages': self.page_times,
+            }
+            with open(self.output + '.json', 'w') as trace_file:
+                json.dump(trace, trace_file, indent=2)
+            print(f'Profile written to {self.output}.pstats and {self.output}.json')
@@ -1,9 +1,11 @@
 import argparse
+import contextlib
 import os
-import csv
 
 from openpyxl import Workbook
 from journaltools import dateconvert
+from journaltools import Profiler
+from journaltools import readrows
 
 # This is an alternate routine to dc-convert.py & journaltools.convertcsv that is used with CSV files exported
 # from mdgen-blr.py. It converts and exports those files to an Excel file that can be cut and pasted into a
@@ -12,12 +14,12 @@ from journaltools import dateconvert
 
 def convertcsv(input_file, output_file, verbose):
     # Import a CSV file that has been exported from this code. Read file, everything except the start and end PDF
-    # pages, then spit them out into an Excel workbook.
+    # pages, then spit them out into an Excel workbook. A .jsonl file from mdgen-blr.py --format jsonl works too.
 
-    # Set Excel workbook filename
-    wb = Workbook()
-    ws = wb.active
-    wbrow = 1
+    # Set Excel workbook filename. The workbook is opened in write-only mode, so rows are streamed out to the file as
+    # they are appended instead of being held in memory.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
     dest_filename = output_file + '.xlsx'
 
     if verbose:
@@ -52,8 +54,7 @@ def convertcsv(input_file, output_file, verbose):
     # The columns are hard-coded to correspond to the Digital Commons import columns for Buffalo Law Review.
     # To be more useful, this could write to an output and write the values in the columns based on the
     # headers.
-    with open(input_file, newline='') as csvfile:
-        data_reader = csv.reader(csvfile, delimiter=",", quotechar="'")
+    with contextlib.closing(readrows(input_file, quotechar="'")) as data_reader:
         for row in data_reader:
             try:
                 title = row[0]
@@ -84,47 +85,31 @@ def convertcsv(input_file, output_file, verbose):
 
             date = dateconvert(year, month)
 
-            ws.cell(row=wbrow, column=1, value=title)
-            ws.cell(row=wbrow, column=42, value=volume)
-            ws.cell(row=wbrow, column=37, value=start_page)
-            ws.cell(row=wbrow, column=36, value=issue)
-            ws.cell(row=wbrow, column=39, value=date)
-            ws.cell(row=wbrow, column=35, value=document_type)
-            ws.cell(row=wbrow, column=5, value=f_name1)
-            ws.cell(row=wbrow, column=6, value=m_name1)
-            ws.cell(row=wbrow, column=7, value=l_name1)
-            ws.cell(row=wbrow, column=8, value=suffix1)
-            if f_name1 != '' and l_name1 == '':
-                ws.cell(row=wbrow, column=11, value='TRUE')
-            else:
-                ws.cell(row=wbrow, column=11, value='FALSE')
-            ws.cell(row=wbrow, column=12, value=f_name2)
-            ws.cell(row=wbrow, column=13, value=m_name2)
-            ws.cell(row=wbrow, column=14, value=l_name2)
-            ws.cell(row=wbrow, column=15, value=suffix2)
-            if f_name2 != '' and l_name2 == '':
-                ws.cell(row=wbrow, column=18, value='TRUE')
-            else:
-                ws.cell(row=wbrow, column=18, value='FALSE')
-            ws.cell(row=wbrow, column=19, value=f_name3)
-            ws.cell(row=wbrow, column=20, value=m_name3)
-            ws.cell(row=wbrow, column=21, value=l_name3)
-            ws.cell(row=wbrow, column=22, value=suffix3)
-            if f_name3 != '' and l_name3 == '':
-                ws.cell(row=wbrow, column=25, value='TRUE')
-            else:
-                ws.cell(row=wbrow, column=25, value='FALSE')
-            ws.cell(row=wbrow, column=26, value=f_name4)
-            ws.cell(row=wbrow, column=27, value=m_name4)
-            ws.cell(row=wbrow, column=28, value=l_name4)
-            ws.cell(row=wbrow, column=29, value=suffix4)
-            if f_name4 != '' and l_name4 == '':
-                ws.cell(row=wbrow, column=32, value='TRUE')
-            else:
-                ws.cell(row=wbrow, column=32, value='FALSE')
-            wbrow += 1
-
-    csvfile.close()
+            # Build the row. Each value goes in the column for the matching Digital Commons field. wb_row is zero
+            # indexed, so each index is the column number minus one.
+            wb_row = [None] * 42
+            wb_row[0] = title
+            wb_row[41] = volume
+            wb_row[36] = start_page
+            wb_row[35] = issue
+            wb_row[38] = date
+            wb_row[34] = document_type
+            for n, (f_name, m_name, l_name, suffix) in enumerate([(f_name1, m_name1, l_name1, suffix1),
+                                                                   (f_name2, m_name2, l_name2, suffix2),
+                                                                   (f_name3, m_name3, l_name3, suffix3),
+                                                                   (f_name4, m_name4, l_name4, suffix4)]):
+                # Each author takes up seven columns, starting at column 5.
+                first_col = 4 + n * 7
+                wb_row[first_col] = f_name
+                wb_row[first_col + 1] = m_name
+                wb_row[first_col + 2] = l_name
+                wb_row[first_col + 3] = suffix
+                if f_name != '' and l_name == '':
+                    wb_row[first_col + 6] = 'TRUE'
+                else:
+                    wb_row[first_col + 6] = 'FALSE'
+            ws.append(wb_row)
+
     wb.save(filename=dest_filename)
     if verbose:
         print(f'Saving {dest_filename}')
@@ -146,6 +131,14 @@ def main():
     parser.add_argument('input_file',
                         type=str,
                         help="Import CSV file to be used for PDF splitting. Must be in same format as export.")
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
     # Split filename from extension before passing to the various functions. Use input filename for template
@@ -155,8 +148,13 @@ def main():
     else:
         output_file, output_extension = os.path.splitext(args.input_file)
 
+    profiler = Profiler(args.profile)
+
     # Read input_file and export to Excel
-    convertcsv(args.input_file, output_file, args.verbose)
+    with profiler.stage('convert'):
+        convertcsv(args.input_file, output_file, args.verbose)
+
+    profiler.report()
 
 
 if __name__ == '__main__':
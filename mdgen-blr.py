@@ -1,11 +1,20 @@
 import argparse
+import concurrent.futures
+import glob
+import io
 import os
 import re
 
 from journaltools import getpdf
+from journaltools import Profiler
+from journaltools import RECORD_FORMATS
+from journaltools import TEXT_MODES
 
 # for exportcsv
+from journaltools import authorrecords
+from journaltools import fieldvalue
 from journaltools import splitname
+from journaltools import writerecords
 import csv
 
 # This is a version of dsplit for current volumes of the Buffalo Law Review. Those volumes come in as individual
@@ -172,8 +181,41 @@ def processpdfnew(verbose, debug, page_text):
     return title, volume, start_page, issue_number, month, year, doc_type, author
 
 
+# Column headers for the CSV file. These match the field names in the README.
+CSV_HEADERS = ['title', 'volume', 'start_page', 'issue', 'month', 'year', 'document_type', 'f_name1', 'm_name1',
+               'l_name1', 'suffix1', 'f_name2', 'm_name2', 'l_name2', 'suffix2', 'f_name3', 'm_name3', 'l_name3',
+               'suffix3', 'f_name4', 'm_name4', 'l_name4', 'suffix4']
+
+
+def csvrow(title, volume, start_page, issue_number, month, year, document_type, author):
+    # Build one CSV row from the metadata for an article. Split each author into separate fields. Authors past the
+    # fourth are dropped and missing ones are left blank. It's hard coded to four, like Digital Commons.
+    row = [title, volume, start_page, issue_number, month, year, document_type]
+    for r in range(0, 4):
+        if r < len(author) and author[r]:
+            row.extend(author[r])
+        else:
+            row.extend(['', '', '', ''])
+    return row
+
+
+def makerecord(title, volume, start_page, issue_number, month, year, document_type, author):
+    # Build the record for an article for the jsonl format. The number fields are ints where they can be, and the
+    # authors are a list with no blank entries. The field names are the same as the csv headers.
+    return {
+        'title': title,
+        'volume': fieldvalue(volume),
+        'start_page': fieldvalue(start_page),
+        'issue': fieldvalue(issue_number),
+        'month': month,
+        'year': fieldvalue(year),
+        'document_type': document_type,
+        'authors': authorrecords([name for name in author if name]),
+    }
+
+
 def exportcsv(output_file, verbose, debug, test, title, volume, start_page, issue_number, month, year,
-              document_type, author):
+              document_type, author, output_format='csv'):
     # This takes a filename, creates that file and then basically just dumps all of the passed lists into the file.
     # It does also write column headers. They are not, strictly speaking, necessary. Especially because all of the
     # code here assumes that any file it uses was generated by it and pulls the data from hard-coded column numbers.
@@ -183,6 +225,15 @@ def exportcsv(output_file, verbose, debug, test, title, volume, start_page, issu
     # delimiter to tab might help Excel editing.
 
     # Also, the import code should probably check the headers and make sure it's pulling in the right columns.
+    #
+    # With output_format 'jsonl', the article is added to a .jsonl file as a record instead (see makerecord).
+    if not test and output_format == 'jsonl':
+        export_file = output_file + RECORD_FORMATS['jsonl']
+        writerecords(export_file, [makerecord(title, volume, start_page, issue_number, month, year, document_type,
+                                              author)], append=True)
+        if verbose:
+            print("Data written to file: %s" % export_file)
+        return
 
     # Initialize empty author variables. This is not the best way to do this. Update from new journaltools.exportcsv.
     for r in range(len(author), 4):
@@ -225,10 +276,7 @@ def exportcsv(output_file, verbose, debug, test, title, volume, start_page, issu
                 quoting=csv.QUOTE_MINIMAL)
             # Write column headers
             if header_flag == 0:
-                data_writer.writerow(['title', 'volume', 'start_page', 'issue', 'month', 'year', 'document_type',
-                                      'f_name1', 'm_name1', 'l_name1', 'suffix1', 'f_name2', 'm_name2', 'l_name2',
-                                      'suffix2', 'f_name3', 'm_name3', 'l_name3', 'suffix3', 'f_name4', 'm_name4',
-                                      'l_name4', 'suffix4'])
+                data_writer.writerow(CSV_HEADERS)
             # Step through each record and write to CSV
             # Split each author name into separate fields before write. Note that this call works without
             # clearing the values each time because SplitName returns blank strings if there is no value.
@@ -268,12 +316,115 @@ def exportcsv(output_file, verbose, debug, test, title, volume, start_page, issu
               f'{l_name3}, {suffix3}, {f_name4}, {m_name4}, {l_name4}, {suffix4}')
 
 
+def processfile(filename, debug, cache=True, refresh_cache=False, mode='layout'):
+    # Read and process one article for batch mode. This runs in a worker process, so it returns the filename and
+    # either the metadata or the error message instead of raising, so one bad file doesn't stop the whole batch.
+    try:
+        page_text = getpdf(filename, 3, False, debug, cache=cache, refresh_cache=refresh_cache, mode=mode)
+        return filename, processpdfnew(False, debug, page_text), None
+    except Exception as error:
+        return filename, None, f'{type(error).__name__}: {error}'
+
+
+def startpagekey(result):
+    # Sort key for batch results. Articles are sorted by start page. Any without a start page go last, in file name
+    # order.
+    filename, metadata, error = result
+    start_page = str(metadata[2])
+    if start_page.isdigit() and int(start_page) > 0:
+        return 0, int(start_page), filename
+    return 1, 0, filename
+
+
+def processbatch(path, output_file, verbose, debug, test, jobs, cache=True, refresh_cache=False, mode='layout',
+                 output_format='csv'):
+    # Batch mode. Process every PDF in a directory (or every file matching a glob pattern) in one run. The first three
+    # pages of each file are read and processed by a pool of worker processes. All of the rows are then sorted by start
+    # page and written to one new CSV file with a single write. Files that can't be processed are listed in
+    # <output_file>-report.txt instead of stopping the batch. With output_format 'jsonl', a .jsonl file of records is
+    # written instead.
+    if os.path.isdir(path):
+        filenames = sorted(glob.glob(os.path.join(path, '*.pdf')))
+    else:
+        filenames = sorted(glob.glob(path))
+    if verbose:
+        print(f'Processing {len(filenames)} files with {jobs} worker processes')
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(processfile, filename, debug, cache, refresh_cache, mode) for filename in filenames]
+        for future in concurrent.futures.as_completed(futures):
+            filename, metadata, error = future.result()
+            if error:
+                print(f'WARNING! Could not process {filename}: {error}')
+            elif verbose:
+                print(f'Processed {filename}')
+            results.append((filename, metadata, error))
+
+    failures = [result for result in results if result[2]]
+    articles = sorted([result for result in results if not result[2]], key=startpagekey)
+
+    # Build the whole CSV file in memory, then write it at once.
+    csv_buffer = io.StringIO()
+    data_writer = csv.writer(
+        csv_buffer,
+        delimiter=',',
+        quotechar='"',
+        doublequote=True,
+        escapechar=" ",
+        quoting=csv.QUOTE_MINIMAL)
+    data_writer.writerow(CSV_HEADERS)
+    for filename, metadata, error in articles:
+        title, volume, start_page, issue_number, month, year, document_type, author = metadata
+        row = csvrow(title, volume, start_page, issue_number, month, year, document_type, author)
+        if debug:
+            print(row)
+        data_writer.writerow(row)
+
+    if test:
+        print("\nTest export data:")
+        print(csv_buffer.getvalue())
+    elif output_format == 'jsonl':
+        export_file = output_file + RECORD_FORMATS['jsonl']
+        writerecords(export_file, [makerecord(*metadata) for filename, metadata, error in articles])
+        if verbose:
+            print("Data written to file: %s" % export_file)
+    else:
+        export_file = output_file + '.csv'
+        with open(export_file, 'w', newline='') as csvfile:
+            csvfile.write(csv_buffer.getvalue())
+        if verbose:
+            print("Data written to file: %s" % export_file)
+
+    # Write the report of files that failed. A report left over from an earlier run is removed when nothing fails, so
+    # it can't be mistaken for this run's.
+    report_file = output_file + '-report.txt'
+    if failures:
+        print(f'WARNING! {len(failures)} of {len(results)} files could not be processed')
+        if not test:
+            with open(report_file, 'w') as reportfile:
+                for filename, metadata, error in sorted(failures):
+                    reportfile.write(f'{filename}: {error}\n')
+            print(f'List of files written to {report_file}')
+    elif not test and os.path.exists(report_file):
+        os.remove(report_file)
+        if verbose:
+            print(f'Removed old report {report_file}')
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('filename',
-                        help='PDF file to analyze and split.',
+                        help='PDF file to analyze and split. With --batch, a directory or a glob pattern (in quotes).',
                         type=str,
                         )
+    parser.add_argument('-b', '--batch',
+                        action='store_true',
+                        dest='batch',
+                        help='Process every PDF in a directory, or every file matching a glob pattern, and write '
+                             'them all to one CSV file sorted by start page. Default output file is <directory>.csv '
+                             'inside the directory.',
+                        )
     parser.add_argument('-v', '--verbose',
                         action='store_true',
                         dest='verbose',
@@ -300,23 +451,87 @@ def main():
                         help='Use supplied filename as filename for the output csv file. Default is <input '
                              'filename>.csv',
                         )
+    parser.add_argument('-f', '--format',
+                        dest='format',
+                        choices=sorted(RECORD_FORMATS),
+                        help='Format of the output file. csv is for editing in a spreadsheet. jsonl keeps numbers as '
+                             'numbers and authors as lists, and can be read back without any loss. Default is csv.',
+                        default='csv',
+                        )
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        help='Number of worker processes to use for reading the PDF text. With --batch, the number '
+                             'of files to process at a time. Default is 1.',
+                        default=1,
+                        )
+    parser.add_argument('--no-cache',
+                        action='store_false',
+                        dest='cache',
+                        help="Don't read or write the page text cache.",
+                        )
+    parser.add_argument('--refresh-cache',
+                        action='store_true',
+                        dest='refresh_cache',
+                        help='Re-read the PDF text and replace any cached copy.',
+                        )
+    parser.add_argument('--text-mode',
+                        dest='text_mode',
+                        choices=sorted(TEXT_MODES),
+                        help='How much layout analysis to do when reading the PDF text. layout is the slowest and '
+                             'is what the extraction rules were written for. lines and raw are faster. See '
+                             'benchmark.py textmodes. Default is layout.',
+                        default='layout',
+                        )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
     # Split filename from extension before passing to the various functions. Use input filename for template
     # if no output filename specified.
     if args.destination:
         output_file, output_extension = os.path.splitext(args.destination)
+    elif args.batch:
+        # Name the CSV file after the directory and put it in the directory.
+        if os.path.isdir(args.filename):
+            directory = args.filename
+        else:
+            directory = os.path.dirname(args.filename) or '.'
+        output_file = os.path.join(directory, os.path.basename(os.path.abspath(directory)))
     else:
         output_file, output_extension = os.path.splitext(args.filename)
 
+    profiler = Profiler(args.profile)
+
+    # In batch mode, process the whole directory at once. --jobs sets the number of files processed at a time. The
+    # files are read in the worker processes, so the profile only has the batch as a whole.
+    if args.batch:
+        with profiler.stage('batch'):
+            processbatch(args.filename, output_file, args.verbose, args.debug, args.test, args.jobs, cache=args.cache,
+                         refresh_cache=args.refresh_cache, mode=args.text_mode, output_format=args.format)
+        profiler.report()
+        return
+
     # Fetch OCR page text from PDF file at args.filename.
-    page_text = getpdf(args.filename, 3, args.verbose, args.debug)
+    with profiler.stage('read'):
+        page_text = getpdf(args.filename, 3, args.verbose, args.debug, workers=args.jobs, cache=args.cache,
+                           refresh_cache=args.refresh_cache, mode=args.text_mode)
     # Process pages in page_text
-    title, volume, fpage, issue, month, year, document_type, authors = processpdfnew(args.verbose, args.debug,
-                                                                                     page_text)
+    with profiler.stage('extract'):
+        title, volume, fpage, issue, month, year, document_type, authors = processpdfnew(args.verbose, args.debug,
+                                                                                         page_text)
     # Export CSV file, or show what output would be if test flag is set
-    exportcsv(output_file, args.verbose, args.debug, args.test, title, volume, fpage, issue, month, year,
-              document_type, authors)
+    with profiler.stage('export csv'):
+        exportcsv(output_file, args.verbose, args.debug, args.test, title, volume, fpage, issue, month, year,
+                  document_type, authors, output_format=args.format)
+
+    profiler.report()
 
 
 if __name__ == '__main__':
@@ -4,6 +4,8 @@ import argparse
 from openpyxl import load_workbook
 from journaltools import exportcsvnew
 from journaltools import capitalize_title
+from journaltools import Profiler
+from journaltools import RECORD_FORMATS
 
 # This program takes in a user-compiled Excel file with the journal metadata and converts it to a CSV file for use
 # with the other tools here. It's used in place of dsplit for journals which are unsuitable for automatic
@@ -14,6 +16,14 @@ from journaltools import capitalize_title
 # A better option is probably to figure out a cleaner way to represent the metadata in the repository.
 
 
+def cellvalue(row, col):
+    # Return the value in column col (zero-indexed) of a row from iter_rows, or None if the row is too short or there
+    # is no column. Read-only worksheets don't always pad out rows to the full width.
+    if col is None or col >= len(row):
+        return None
+    return row[col]
+
+
 def importxl(import_file):
     # Import CSV file for this issue. User should in theory use a template with the right fields. Note to self: create
     # a template. Read each row, do some minor processing, then put the contents into a set of variables.
@@ -28,93 +38,94 @@ def importxl(import_file):
     author = []
     section = []
 
-    # Set defaults for columns; will be overwritten as necessary
-    section_col = 1
-    title_col = 2
-    page_col = 3
-    start_col = 4
-    end_col = 5
-    first_col = 6
-    middle_col = 7
-    last_col = 8
-    suffix_col = 9
-    author2_first_col = 0
-    author2_middle_col = 0
-    author2_last_col = 0
-    author2_suffix_col = 0
-
-    wb = load_workbook(filename=import_file, data_only=True)
+    # Set defaults for columns; will be overwritten as necessary. Columns are zero-indexed positions in each row.
+    # The second author columns are None unless the file has them.
+    section_col = 0
+    title_col = 1
+    page_col = 2
+    start_col = 3
+    end_col = 4
+    first_col = 5
+    middle_col = 6
+    last_col = 7
+    suffix_col = 8
+    author2_first_col = None
+    author2_middle_col = None
+    author2_last_col = None
+    author2_suffix_col = None
+
+    # Open the workbook read-only and stream the rows out with iter_rows. This only reads each row once, in order,
+    # instead of looking up every cell separately, and doesn't load the whole workbook into memory.
+    wb = load_workbook(filename=import_file, read_only=True, data_only=True)
     ws = wb.active
+    rows = ws.iter_rows(values_only=True)
     # Read first row and get headers.
-    headers = []
-    for c in range(1, ws.max_column+1):
-        headers.append(ws.cell(row=1, column=c).internal_value)
+    headers = next(rows, ())
     for c in range(0, len(headers)):
         if headers[c] == 'section':
-            section_col = c + 1
+            section_col = c
         if headers[c] == 'title':
-            title_col = c + 1
+            title_col = c
         if headers[c] == 'page':
-            page_col = c + 1
+            page_col = c
         if headers[c] == 'start_pdf_page':
-            start_col = c + 1
+            start_col = c
         if headers[c] == 'end_pdf_page':
-            end_col = c + 1
+            end_col = c
         if headers[c] == 'author_first':
-            first_col = c + 1
+            first_col = c
         if headers[c] == 'author_middle':
-            middle_col = c + 1
+            middle_col = c
         if headers[c] == 'author_last':
-            last_col = c + 1
+            last_col = c
         if headers[c] == 'author_suffix':
-            suffix_col = c + 1
+            suffix_col = c
         if headers[c] == 'author2_first':
-            author2_first_col = c + 1
+            author2_first_col = c
         if headers[c] == 'author2_middle':
-            author2_middle_col = c + 1
+            author2_middle_col = c
         if headers[c] == 'author2_last':
-            author2_last_col = c + 1
+            author2_last_col = c
         if headers[c] == 'author2_suffix':
-            author2_suffix_col = c + 1
+            author2_suffix_col = c
 
-    # Iterate through all rows, reading values into lists to pass back to main.
-    max_row = ws.max_row
-    for i in range(2, max_row+1):
-        section_temp = ws.cell(row=i, column=section_col).internal_value
+    # Iterate through all rows, reading values into lists to pass back to main. Skip rows with nothing in them.
+    for row in rows:
+        if not any(value is not None for value in row):
+            continue
+        section_temp = cellvalue(row, section_col)
         if section_temp:
             section_temp = section_temp.title()
             section_temp = capitalize_title(section_temp)
         section.append(section_temp)
-        temp_title = ws.cell(row=i, column=title_col).internal_value
+        temp_title = cellvalue(row, title_col)
         temp_title = temp_title.title()
         temp_title = capitalize_title(temp_title)
         title.append(temp_title)
-        page_temp = ws.cell(row=i, column=page_col).internal_value
+        page_temp = cellvalue(row, page_col)
         if page_temp:
             page.append(page_temp)
         else:
             page.append('')
-        pdf_start_page.append(ws.cell(row=i, column=start_col).internal_value)
-        pdf_end_page.append(ws.cell(row=i, column=end_col).internal_value)
-        author_temp = ws.cell(row=i, column=first_col).internal_value, \
-            ws.cell(row=i, column=middle_col).internal_value, ws.cell(row=i, column=last_col).internal_value, \
-            ws.cell(row=i, column=suffix_col).internal_value
+        pdf_start_page.append(cellvalue(row, start_col))
+        pdf_end_page.append(cellvalue(row, end_col))
+        author_temp = cellvalue(row, first_col), cellvalue(row, middle_col), cellvalue(row, last_col), \
+            cellvalue(row, suffix_col)
         author_list = [author_temp]
         # Only look for second author if there were second author columns in the input file.
-        if author2_first_col:
+        if author2_first_col is not None:
             # If there are columns in the input file for a second author, check to make sure there's a value in the
             # first name field. If there is, then pull all four columns into a tuple, then append it to the list.
-            if ws.cell(row=i, column=author2_first_col).internal_value:
-                author_temp = ws.cell(row=i, column=author2_first_col).internal_value, \
-                               ws.cell(row=i, column=author2_middle_col).internal_value, \
-                               ws.cell(row=i, column=author2_last_col).internal_value, \
-                               ws.cell(row=i, column=author2_suffix_col).internal_value
+            if cellvalue(row, author2_first_col):
+                author_temp = cellvalue(row, author2_first_col), cellvalue(row, author2_middle_col), \
+                               cellvalue(row, author2_last_col), cellvalue(row, author2_suffix_col)
                 author_list.append(author_temp)
 
         if author_list:
             author.append(author_list)
         else:
             author.append('')
+    wb.close()
 
     return title, page, pdf_start_page, pdf_end_page, author, section
 
@@ -145,6 +156,20 @@ def main():
                         type=str,
                         help='Use supplied filename as filename template for output files.',
                         )
+    parser.add_argument('-f', '--format',
+                        dest='format',
+                        choices=sorted(RECORD_FORMATS),
+                        help='Format of the output file. Default is csv.',
+                        default='csv',
+                        )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
     # Split filename from extension before passing to the various functions. Use input filename for template
@@ -154,11 +179,17 @@ def main():
     else:
         output_file, output_extension = os.path.splitext(args.filename)
 
+    profiler = Profiler(args.profile)
+
     # Fetch metadata from import Excel file
-    title, start_page, start_pdf_page, end_pdf_page, author, section = importxl(args.filename)
+    with profiler.stage('import excel'):
+        title, start_page, start_pdf_page, end_pdf_page, author, section = importxl(args.filename)
     # Export CSV file, or show what output would be if test flag is set
-    exportcsvnew(output_file, args.verbose, args.debug, args.test, title, start_page, start_pdf_page,
-                 end_pdf_page, author, section=section)
+    with profiler.stage('export csv'):
+        exportcsvnew(output_file, args.verbose, args.debug, args.test, title, start_page, start_pdf_page,
+                     end_pdf_page, author, section=section, output_format=args.format)
+
+    profiler.report()
 
 
 if __name__ == '__main__':
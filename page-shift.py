@@ -26,6 +26,14 @@ if __name__ == '__main__':
                         type=str,
                         help="Import CSV file to be used for PDF splitting. Must be in same format as export.",
                         )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
     # Separate filename from extension. Add '-NEW' to output filename.
@@ -35,4 +43,7 @@ if __name__ == '__main__':
         output_file, output_extension = os.path.splitext(args.input_file1)
         output_file = output_file + "-NEW" + output_extension
 
-    journaltools.shiftpage(args.input_file1, args.input_file2, output_file, args.verbose)
+    profiler = journaltools.Profiler(args.profile)
+    with profiler.stage('shift'):
+        journaltools.shiftpage(args.input_file1, args.input_file2, output_file, args.verbose)
+    profiler.report()
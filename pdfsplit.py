@@ -42,6 +42,26 @@ if __name__ == '__main__':
                         type=str,
                         help="Import CSV file to be used for PDF splitting. Must be in same format as export. "
                              "Default is filename with .csv extension.")
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        help='Number of threads to use for writing the split PDFs. Default is 1.',
+                        default=1,
+                        )
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        dest='incremental',
+                        help='Keep a manifest in the output directory and skip the split if the PDF, the split points '
+                             'and the output files are unchanged since the last run.',
+                        )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
     # Split filename from extension before passing to the various functions. Use input filename for template
@@ -51,18 +71,41 @@ if __name__ == '__main__':
     else:
         output_file, output_extension = os.path.splitext(args.filename)
 
-    # Set input CSV filename. If no filename provided, use the input filename with CSV extension.
+    # Set input CSV filename. If no filename provided, use the input filename with CSV extension, or .jsonl if there is
+    # no CSV file.
     if args.input_file:
         input_file = args.input_file
     else:
         input_file, input_extension = os.path.splitext(args.filename)
-        input_file = input_file + '.csv'
+        if os.path.exists(input_file + '.csv') or not os.path.exists(input_file + '.jsonl'):
+            input_file = input_file + '.csv'
+        else:
+            input_file = input_file + '.jsonl'
+
+    profiler = journaltools.Profiler(args.profile)
 
     # Read CSVfile and get starting and ending PDF pages to pass to splitpdf
     if os.path.exists(input_file):
-        start_pdf_page, end_pdf_page = journaltools.importcsv(input_file, args.debug)
-        # Split Original PDF into separate documents for each piece, unless test flag is set
+        with profiler.stage('import csv'):
+            start_pdf_page, end_pdf_page = journaltools.importcsv(input_file, args.debug)
+        # Split Original PDF into separate documents for each piece, unless test flag is set. With --incremental,
+        # skip the split if it has already been done with the same pages (see dsplit).
         if not args.test:
-            journaltools.splitpdf(args.filename, args.verbose, args.debug, start_pdf_page, end_pdf_page, output_file)
+            manifest = None
+            if args.incremental:
+                manifest = journaltools.loadmanifest(os.path.dirname(os.path.abspath(output_file)))
+            split_step = journaltools.manifeststep(manifest, 'splitpdf', args.filename, {
+                'start_pdf_page': start_pdf_page,
+                'end_pdf_page': end_pdf_page,
+                'output_file': os.path.basename(output_file),
+            })
+            if not journaltools.isfresh(manifest, split_step):
+                with profiler.stage('split'):
+                    journaltools.splitpdf(args.filename, args.verbose, args.debug, start_pdf_page, end_pdf_page,
+                                          output_file, jobs=args.jobs)
+                journaltools.recordstep(manifest, split_step, [f'{output_file}-{r}.pdf'
+                                                               for r in range(0, len(start_pdf_page))])
+            journaltools.savemanifest(manifest)
+        profiler.report()
     else:
         print(f'{input_file} not present. Please specify a valid CSV file to use for the split points.')
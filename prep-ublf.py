@@ -32,6 +32,14 @@ if __name__ == '__main__':
                         type=str,
                         help="Import PDF file to have pages doubled.",
                         )
+    parser.add_argument('--profile',
+                        dest='profile',
+                        nargs='?',
+                        const=True,
+                        metavar='PREFIX',
+                        help='Print the time and memory used by each stage. If PREFIX is given, also write a '
+                             'cProfile dump to PREFIX.pstats and a JSON trace to PREFIX.json.',
+                        )
     args = parser.parse_args()
 
     # If destination file specified, assign it to output_file. If not, then use input filename.
@@ -41,5 +49,8 @@ if __name__ == '__main__':
         output_file, output_extension = os.path.splitext(args.filename)
         output_file = output_file + "-NEW" + output_extension
 
+    profiler = journaltools.Profiler(args.profile)
     if not args.test:
-        journaltools.croppages(args.filename, output_file, args.verbose, args.debug)
+        with profiler.stage('crop'):
+            journaltools.croppages(args.filename, output_file, args.verbose, args.debug)
+    profiler.report()
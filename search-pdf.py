@@ -0,0 +1,64 @@
+import argparse
+import sqlite3
+import time
+
+import journaltools
+
+# Search the full text index built by index-pdf.py for the pages a title, author or any other text appears on. Page
+# numbers are zero-indexed, like start_pdf_page and end_pdf_page in the csv files.
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Find the PDF pages that contain a title, author name or other text.'
+    )
+    parser.add_argument('query',
+                        type=str,
+                        help='Text to search for. It is searched for as a phrase, and case doesn\'t matter.',
+                        )
+    parser.add_argument('-x', '--index',
+                        dest='index_file',
+                        type=str,
+                        help=f'Index file. Default is {journaltools.INDEX_FILE}, or the JOURNALTOOLS_INDEX environment '
+                             f'variable.',
+                        default=journaltools.INDEX_FILE,
+                        )
+    parser.add_argument('-n', '--limit',
+                        dest='limit',
+                        type=int,
+                        help='Most results to show. Default is 20.',
+                        default=20,
+                        )
+    parser.add_argument('-q', '--query-syntax',
+                        action='store_false',
+                        dest='phrase',
+                        help='Use the SQLite FTS5 query syntax instead of searching for a phrase. For example, '
+                             '\'"due process" AND counsel\' or \'constitu*\'.',
+                        )
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        dest='verbose',
+                        help='Print status messages.',
+                        )
+    args = parser.parse_args()
+
+    connection = journaltools.openindex(args.index_file)
+    start_time = time.perf_counter()
+    try:
+        results = journaltools.searchindex(connection, args.query, args.limit, args.phrase)
+    except sqlite3.OperationalError as error:
+        # A malformed FTS5 query with -q, like an unbalanced quote or a bare AND.
+        parser.error(f'Could not search for {args.query!r}: {error}. See the SQLite FTS5 documentation for the '
+                     f'query syntax, or leave out -q to search for a phrase.')
+    finally:
+        connection.close()
+    elapsed = time.perf_counter() - start_time
+
+    for path, page, snippet in results:
+        print(f'{path}, page {page}: {" ".join(snippet.split())}')
+    if args.verbose or not results:
+        print(f'{len(results)} pages found in {elapsed * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
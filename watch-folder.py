@@ -0,0 +1,236 @@
+import argparse
+import collections
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import time
+
+import journaltools
+
+# Long-running service for the scanning station. Watch a directory for new PDF files and run each one through the
+# same steps as running the command-line tools by hand: prep-ublf (optional), dsplit with one of the rule profiles in
+# journaltools.PROFILES, pdfsplit, and dc-convert (optional). The directory is polled, so it works the same on network
+# shares, where file system events aren't reliable.
+#
+# Files are handed to a pool of worker processes that stay running for as long as the service does, so pdfminer and
+# PyPDF2 are only imported once per worker instead of once per file. Each file is processed into a temp directory
+# inside the output directory, and the results are then moved into <output dir>/<file name>/ one file at a time with
+# os.replace, so nothing ever sees a half-written csv or PDF. What has been processed is kept in the journaltools
+# manifest in the output directory, so restarting the service doesn't redo anything unless the file or the settings
+# have changed.
+
+
+def processwatched(filename, output_dir, rules, crop, split, excel, template_file, text_mode, output_format):
+    # Process one PDF file. This runs in a worker process, so it returns the filename, the list of files written and
+    # either None or an error message, instead of raising, so one bad file doesn't stop the service.
+    name, extension = os.path.splitext(os.path.basename(filename))
+    temp_dir = tempfile.mkdtemp(prefix='.' + name + '-', dir=output_dir)
+    try:
+        # Crop double pages first, if asked (see prep-ublf.py). Everything after that works on the cropped file.
+        source = filename
+        if crop:
+            source = os.path.join(temp_dir, name + '-NEW' + extension)
+            journaltools.croppages(filename, source, False, False)
+
+        # Extract the metadata and write it (see the dsplit files).
+        output_file = os.path.join(temp_dir, name)
+        pages = journaltools.iter_pdf_pages(source, 0, False, 0, mode=text_mode)
+        title, start_page, start_pdf_page, end_pdf_page, author = journaltools.extractmetadata(
+            pages, journaltools.PROFILES[rules], False, 0)
+        journaltools.exportcsvnew(output_file, False, 0, False, title, start_page, start_pdf_page, end_pdf_page,
+                                  author, output_format=output_format)
+
+        # Split the PDF and convert the metadata to Excel, if asked (see pdfsplit.py and dc-convert.py).
+        if split:
+            journaltools.splitpdf(source, False, 0, start_pdf_page, end_pdf_page, output_file)
+        if excel:
+            journaltools.convertcsv(output_file + journaltools.RECORD_FORMATS[output_format], output_file,
+                                    template_file, False, 0)
+
+        # Move everything into place.
+        final_dir = os.path.join(output_dir, name)
+        os.makedirs(final_dir, exist_ok=True)
+        outputs = []
+        for output in sorted(os.listdir(temp_dir)):
+            os.replace(os.path.join(temp_dir, output), os.path.join(final_dir, output))
+            outputs.append(os.path.join(final_dir, output))
+        return filename, outputs, None
+    except Exception as error:
+        return filename, [], f'{type(error).__name__}: {error}'
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def scanfolder(path):
+    # Return a dictionary of the PDF files in path, with the size and modification time of each one. Files are only
+    # processed once these stop changing, so a file that is still being copied in is left alone.
+    files = {}
+    for entry in os.scandir(path):
+        if entry.is_file() and entry.name.lower().endswith('.pdf') and not entry.name.startswith('.'):
+            stat = entry.stat()
+            files[entry.path] = stat.st_size, stat.st_mtime_ns
+    return files
+
+
+def watchfolder(path, output_dir, verbose, jobs, interval, once, rules, crop, split, excel, template_file, text_mode,
+                output_format):
+    # Main loop. Every interval seconds, look for PDFs that haven't changed since the last look and haven't already
+    # been processed with the same settings, and queue them. No more than jobs files are given to the pool at a time;
+    # the rest wait in the queue. With once, process what is there now and stop.
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = journaltools.loadmanifest(output_dir)
+    template_hash = None
+    if template_file:
+        template_hash = journaltools.filehash(template_file)
+    settings = {
+        'rules': journaltools.ruleshash(journaltools.PROFILES[rules]),
+        'crop': crop,
+        'split': split,
+        'excel': excel,
+        'template': template_hash,
+        'text_mode': text_mode,
+        'format': output_format,
+    }
+
+    last_seen = {}
+    checked = {}
+    queue = collections.deque()
+    running = {}
+    if verbose:
+        print(f'Watching {path}. Output goes to {output_dir}')
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            # Queue new files. A file is checked against the manifest once for each version of it, so a skipped file
+            # is only reported once.
+            files = scanfolder(path)
+            for filename, signature in sorted(files.items()):
+                stable = once or last_seen.get(filename) == signature
+                if stable and checked.get(filename) != signature:
+                    checked[filename] = signature
+                    step = journaltools.manifeststep(manifest, 'watch', filename, settings)
+                    if not journaltools.isfresh(manifest, step):
+                        if verbose:
+                            print(f'Queued {filename}')
+                        queue.append(step)
+            last_seen = files
+
+            # Start as many queued files as there are free workers.
+            while queue and len(running) < jobs:
+                step = queue.popleft()
+                future = executor.submit(processwatched, step['input_file'], output_dir, rules, crop, split, excel,
+                                         template_file, text_mode, output_format)
+                running[future] = step
+
+            # Wait for work to finish, or for the next time to look at the directory.
+            if running:
+                finished, pending = concurrent.futures.wait(running, timeout=interval,
+                                                            return_when=concurrent.futures.FIRST_COMPLETED)
+            else:
+                finished = []
+                if once:
+                    break
+                time.sleep(interval)
+
+            for future in finished:
+                step = running.pop(future)
+                filename, outputs, error = future.result()
+                if error:
+                    # Leave it out of the manifest. It will be tried again if the file changes.
+                    print(f'WARNING! Could not process {filename}: {error}')
+                    continue
+                journaltools.recordstep(manifest, step, outputs)
+                journaltools.savemanifest(manifest)
+                print(f'Processed {filename}: {len(outputs)} files written to '
+                      f'{os.path.dirname(outputs[0]) if outputs else output_dir}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Watch a directory for new PDF files and extract metadata from them, split them and convert the '
+                    'metadata to Excel as they come in.'
+    )
+    parser.add_argument('path',
+                        type=str,
+                        help='Directory to watch for PDF files.',
+                        )
+    parser.add_argument('-o', '--output-dir',
+                        dest='output_dir',
+                        type=str,
+                        help='Directory to write the results to. Each PDF gets its own directory in here. Default is '
+                             '<path>/processed.',
+                        )
+    parser.add_argument('-r', '--rules',
+                        dest='rules',
+                        choices=sorted(journaltools.PROFILES),
+                        help='Rule profile to extract the metadata with (see the dsplit files). Default is rd.',
+                        default='rd',
+                        )
+    parser.add_argument('-c', '--crop',
+                        action='store_true',
+                        dest='crop',
+                        help='Crop double pages to 8.5 x 11 before anything else, like prep-ublf.py.',
+                        )
+    parser.add_argument('--no-split',
+                        action='store_false',
+                        dest='split',
+                        help="Write the metadata, but don't split the PDF.",
+                        )
+    parser.add_argument('-x', '--excel',
+                        action='store_true',
+                        dest='excel',
+                        help='Also convert the metadata to an Excel file, like dc-convert.py.',
+                        )
+    parser.add_argument('-p', '--template',
+                        dest='template_file',
+                        type=str,
+                        help='Excel file to use as the template for --excel. See dc-convert.py.',
+                        )
+    parser.add_argument('-f', '--format',
+                        dest='format',
+                        choices=sorted(journaltools.RECORD_FORMATS),
+                        help='Format of the metadata files. Default is csv.',
+                        default='csv',
+                        )
+    parser.add_argument('--text-mode',
+                        dest='text_mode',
+                        choices=sorted(journaltools.TEXT_MODES),
+                        help='How much layout analysis to do when reading the PDF text. Default is layout.',
+                        default='layout',
+                        )
+    parser.add_argument('-j', '--jobs',
+                        dest='jobs',
+                        type=int,
+                        help='Number of files to process at a time. Default is 1.',
+                        default=1,
+                        )
+    parser.add_argument('-i', '--interval',
+                        dest='interval',
+                        type=float,
+                        help='Seconds between looks at the directory. A file has to be the same size on two looks in '
+                             'a row before it is processed. Default is 10.',
+                        default=10,
+                        )
+    parser.add_argument('--once',
+                        action='store_true',
+                        dest='once',
+                        help='Process the files that are there now, then stop.',
+                        )
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        dest='verbose',
+                        help='Print status messages.',
+                        )
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(args.path, 'processed')
+    try:
+        watchfolder(args.path, output_dir, args.verbose, args.jobs, args.interval, args.once, args.rules, args.crop,
+                    args.split, args.excel, args.template_file, args.text_mode, args.format)
+    except KeyboardInterrupt:
+        print('Stopped.')
+
+
+if __name__ == '__main__':
+    main()